@@ -0,0 +1,336 @@
+"""
+Background warming of the geocode and map-data caches.
+
+Most poster requests are for the same few hundred places, yet the first job
+for each after a cache flush or a deploy pays for Nominatim and Overpass in
+full. record_request counts every (city, country, distance) the web UI has
+geocoded, in memory; the history is written to cache/request_history.json
+at most every HISTORY_FLUSH_SECONDS and by flush_history. CacheWarmer walks the most
+requested keys, then a configured list of places, and for each one looks up
+the coordinates (filling the geocode cache) and fetches the map data at the
+default level of detail (filling osmnx's Overpass response cache and the
+feature cache), so a later job for the same key reads everything from disk.
+
+Warming only happens while the server is idle, meaning no job is running or
+waiting and no poster was requested for idle_seconds. It warms at most
+requests_per_hour keys an hour, since on a cold cache each key costs a
+Nominatim lookup and three Overpass queries. A warmed key is left alone for
+refresh_hours. Fetches reserve their memory with the admission controller at
+the lowest priority and hand their slot over between layers, so user jobs
+always come first; keys too large to leave room for a user job next to them
+(max_budget_share) are not warmed.
+
+Run standalone to warm the caches once, e.g. as a deploy step:
+
+    python cache_warmer.py --requests-per-hour 120 --places places.txt
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+
+from create_map_poster import fetch_map_data, get_coordinates
+from gazetteer import normalize
+from scheduler import estimate_job, record_map_data
+from storage import MB
+
+REQUEST_HISTORY_FILE = os.path.join("cache", "request_history.json")
+# Keys not requested for this long are dropped from the history
+HISTORY_MAX_AGE_DAYS = 90
+HISTORY_FLUSH_SECONDS = 60
+# Only this many of the most requested keys are warmed
+TOP_REQUESTS = 200
+IDLE_SECONDS = 30
+REFRESH_HOURS = 7 * 24
+# How often the warming thread checks for idle time
+POLL_SECONDS = 5
+DEFAULT_DISTANCE = 29000
+# Admission client id of warming fetches
+WARMER_CLIENT = "cache-warmer"
+# Share of the admission budget a warming fetch may reserve
+MAX_BUDGET_SHARE = 0.5
+# The places suggested by create_map_poster.print_examples
+DEFAULT_PLACES = (
+    ("New York", "USA", 12000),
+    ("Barcelona", "Spain", 8000),
+    ("Venice", "Italy", 4000),
+    ("Amsterdam", "Netherlands", 6000),
+    ("Dubai", "UAE", 15000),
+    ("Paris", "France", 10000),
+    ("Moscow", "Russia", 12000),
+    ("Tokyo", "Japan", 15000),
+    ("Marrakech", "Morocco", 5000),
+    ("Rome", "Italy", 8000),
+    ("San Francisco", "USA", 10000),
+    ("Sydney", "Australia", 12000),
+    ("Mumbai", "India", 18000),
+    ("London", "UK", 15000),
+    ("Budapest", "Hungary", 8000),
+)
+
+_history = None
+_history_lock = threading.Lock()
+_history_dirty = False
+_last_flush = 0.0
+_last_request = None
+
+
+def _request_key(city, country, distance):
+    return f"{normalize(city)}|{normalize(country)}|{int(distance)}"
+
+
+def _load_history():
+    global _history
+    if _history is None:
+        try:
+            with open(REQUEST_HISTORY_FILE, "r", encoding="utf-8") as f:
+                _history = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            _history = {}
+    return _history
+
+
+def _write_history():
+    # Called with _history_lock held
+    global _history_dirty, _last_flush
+    cutoff = time.time() - HISTORY_MAX_AGE_DAYS * 24 * 60 * 60
+    history = _load_history()
+    for stale in [key for key, entry in history.items() if entry["last"] < cutoff]:
+        del history[stale]
+    os.makedirs(os.path.dirname(REQUEST_HISTORY_FILE), exist_ok=True)
+    tmp_path = f"{REQUEST_HISTORY_FILE}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(history, f, indent=1, ensure_ascii=False)
+    os.replace(tmp_path, REQUEST_HISTORY_FILE)
+    _history_dirty = False
+    _last_flush = time.monotonic()
+
+
+def record_request(city, country, distance):
+    """
+    Counts a poster request for a place that was found (geocoded) in the
+    history, remembering the spelling of its latest request for warming.
+    """
+    global _history_dirty, _last_request
+    with _history_lock:
+        _last_request = time.monotonic()
+        history = _load_history()
+        key = _request_key(city, country, distance)
+        count = history.get(key, {}).get("count", 0)
+        history[key] = {
+            "city": city,
+            "country": country,
+            "distance": int(distance),
+            "count": count + 1,
+            "last": time.time(),
+        }
+        _history_dirty = True
+        if _last_request - _last_flush >= HISTORY_FLUSH_SECONDS:
+            _write_history()
+
+
+def flush_history():
+    """
+    Writes requests recorded since the last write to the history file.
+    """
+    with _history_lock:
+        if _history_dirty:
+            _write_history()
+
+
+def popular_requests(limit=TOP_REQUESTS):
+    """
+    Returns the most requested (city, country, distance) keys, most
+    requested first.
+    """
+    with _history_lock:
+        entries = sorted(_load_history().values(), key=lambda entry: (-entry["count"], -entry["last"]))
+    return [(entry["city"], entry["country"], entry["distance"]) for entry in entries[:limit]]
+
+
+def seconds_since_last_request():
+    """
+    Returns the seconds since record_request was last called in this
+    process, or None if it never was.
+    """
+    if _last_request is None:
+        return None
+    return time.monotonic() - _last_request
+
+
+def load_places(path):
+    """
+    Reads a list of places to warm, one "City, Country[, distance]" per
+    line; blank lines and lines starting with # are skipped. Raises
+    ValueError for a malformed line.
+    """
+    places = []
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = [field.strip() for field in line.split(",")]
+            try:
+                if len(fields) not in (2, 3) or not all(fields):
+                    raise ValueError
+                distance = int(fields[2]) if len(fields) == 3 else DEFAULT_DISTANCE
+            except ValueError:
+                raise ValueError(f"{path}:{number}: expected 'City, Country[, distance]'") from None
+            places.append((fields[0], fields[1], distance))
+    return places
+
+
+class CacheWarmer:
+    """
+    Warms the caches for popular and configured places in idle time, one
+    key every 3600 / requests_per_hour seconds at most. admission, if given,
+    is the AdmissionController user jobs run under; warming then waits for
+    it to be idle and reserves its fetches there, skipping keys that would
+    take more than max_budget_share of its budget.
+    """
+
+    def __init__(
+        self,
+        requests_per_hour,
+        places=DEFAULT_PLACES,
+        admission=None,
+        top=TOP_REQUESTS,
+        idle_seconds=IDLE_SECONDS,
+        refresh_hours=REFRESH_HOURS,
+        max_budget_share=MAX_BUDGET_SHARE,
+    ):
+        self.requests_per_hour = requests_per_hour
+        self.places = list(places)
+        self.admission = admission
+        self.top = top
+        self.idle_seconds = idle_seconds
+        self.refresh_seconds = refresh_hours * 60 * 60
+        self.max_budget_share = max_budget_share
+        self.counts = {"warmed": 0, "failed": 0, "skipped": 0}
+        self.last_warmed = None
+        self._attempts = {}
+        self._next_at = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def due(self):
+        """
+        Returns the keys to warm, most requested first and then the
+        configured places, leaving out those attempted in the last
+        refresh_hours.
+        """
+        now = time.monotonic()
+        seen = set()
+        keys = []
+        for city, country, distance in popular_requests(self.top) + self.places:
+            key = _request_key(city, country, distance)
+            if key in seen:
+                continue
+            seen.add(key)
+            attempted = self._attempts.get(key)
+            if attempted is None or now - attempted >= self.refresh_seconds:
+                keys.append((city, country, distance))
+        return keys
+
+    def is_idle(self):
+        since = seconds_since_last_request()
+        if since is not None and since < self.idle_seconds:
+            return False
+        if self.admission is None:
+            return True
+        usage = self.admission.usage()
+        return usage["running"] == 0 and not any(usage["waiting"].values())
+
+    def warm(self, city, country, distance):
+        """
+        Fills the geocode and map-data caches for one key. Returns True if
+        it succeeded; a failed or skipped key is retried after refresh_hours
+        like any other.
+        """
+        self._attempts[_request_key(city, country, distance)] = time.monotonic()
+        try:
+            point = get_coordinates(city, country)
+            estimate = estimate_job(point, distance)
+            if self.admission:
+                nbytes = self.admission.admissible_bytes(estimate, "fetch_bytes")
+                if nbytes > self.admission.budget_bytes * self.max_budget_share:
+                    self.counts["skipped"] += 1
+                    print(f"⚠ Not warming {city}, {country} ({distance} m): about {nbytes / MB:,.0f} MB to fetch")
+                    return False
+                reservation = self.admission.reserve(nbytes, priority="print", client=WARMER_CLIENT)
+            else:
+                reservation = nullcontext()
+            with reservation as held:
+                checkpoint = held.checkpoint if held else None
+                map_data = fetch_map_data(point, distance, show_progress=False, checkpoint=checkpoint)
+            record_map_data(point, distance, map_data)
+        except Exception as exc:
+            self.counts["failed"] += 1
+            print(f"⚠ Could not warm {city}, {country} ({distance} m): {exc}")
+            return False
+        self.counts["warmed"] += 1
+        self.last_warmed = {"city": city, "country": country, "distance": distance, "at": time.time()}
+        print(f"✓ Warmed {city}, {country} ({distance} m)")
+        return True
+
+    def step(self):
+        """
+        Warms the next due key if the server is idle and the rate budget
+        allows it. Returns True if a key was warmed or attempted.
+        """
+        if time.monotonic() < self._next_at or not self.is_idle():
+            return False
+        keys = self.due()
+        if not keys:
+            return False
+        self._next_at = time.monotonic() + 3600 / self.requests_per_hour
+        self.warm(*keys[0])
+        return True
+
+    def _run(self):
+        while not self._stop_event.wait(POLL_SECONDS):
+            flush_history()
+            self.step()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="cache-warmer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+    def stats(self):
+        return {
+            "requests_per_hour": self.requests_per_hour,
+            "due": len(self.due()),
+            **self.counts,
+            "last_warmed": self.last_warmed,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm the geocode and map-data caches once.")
+    parser.add_argument("--requests-per-hour", type=float, default=60, help="Rate budget (default: 60)")
+    parser.add_argument("--places", help="File of 'City, Country[, distance]' lines (default: the example places)")
+    parser.add_argument("--top", type=int, default=TOP_REQUESTS, help=f"Most requested keys to warm (default: {TOP_REQUESTS})")
+    args = parser.parse_args()
+
+    places = load_places(args.places) if args.places else DEFAULT_PLACES
+    warmer = CacheWarmer(args.requests_per_hour, places=places, top=args.top)
+    keys = warmer.due()
+    print(f"Warming {len(keys)} places at up to {args.requests_per_hour:g} an hour...")
+    for index, key in enumerate(keys):
+        if index:
+            time.sleep(3600 / args.requests_per_hour)
+        warmer.warm(*key)
+    print(f"✓ Warmed {warmer.counts['warmed']} places, {warmer.counts['failed']} failed")
+
+
+if __name__ == "__main__":
+    main()
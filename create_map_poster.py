@@ -1,25 +1,100 @@
 import matplotlib
 matplotlib.use("Agg")
 import osmnx as ox
+from osmnx._errors import InsufficientResponseError
 import matplotlib.pyplot as plt
 from matplotlib.font_manager import FontProperties
 import matplotlib.colors as mcolors
+from matplotlib.collections import LineCollection
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path
 import numpy as np
+import shapely
+from shapely.geometry.polygon import orient
 from geopy.geocoders import Nominatim
 import ssl
 import certifi
 from tqdm import tqdm
 import time
 import json
+import io
 import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
+from urllib.parse import urlsplit
 import argparse
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+import feature_cache
+import gazetteer
+import geocode_cache
+import profiling
+import shared_geometry
+from theme_registry import ThemeRegistry, compile_theme
 
 THEMES_DIR = "themes"
 FONTS_DIR = "fonts"
 POSTERS_DIR = "posters"
 OUTPUT_FIGSIZE = (12, 15.6667)
 OUTPUT_DPI = 600
+OUTPUT_FORMATS = ('png', 'svg', 'pdf')
+VECTOR_FORMATS = ('svg', 'pdf')
+# Vector coordinates are snapped to a grid this fine (grid cells per inch).
+VECTOR_GRID_DPI = 1200
+# Output specs: WIDTHxHEIGHT in inches, optionally @DPI and .FORMAT
+OUTPUT_SPEC_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)x(\d+(?:\.\d+)?)(?:@(\d+))?(?:\.([a-z]+))?$')
+# Split rendering cuts the map into this many bands per worker process
+BANDS_PER_PROCESS = 2
+# zlib levels behind the PNG encoder speed/size tradeoff
+PNG_COMPRESSION_LEVELS = {'fast': 1, 'balanced': 6, 'small': 9}
+PNG_MODES = ('auto', 'rgba', 'rgb', 'palette')
+# Public OSM services by default; point these at local stand-ins (see
+# loadtest.py) to run without touching them.
+PUBLIC_NOMINATIM_URL = 'https://nominatim.openstreetmap.org/search'
+NOMINATIM_URL = os.environ.get('NOMINATIM_URL', PUBLIC_NOMINATIM_URL)
+OVERPASS_URL = os.environ.get('OVERPASS_URL', 'https://overpass-api.de/api')
+ox.settings.overpass_url = OVERPASS_URL
+# Nominatim's usage policy allows one request a second
+NOMINATIM_INTERVAL_SECONDS = 1.0
+_nominatim_next = 0.0
+_nominatim_lock = threading.Lock()
+
+ROAD_WIDTHS = {
+    'road_motorway': 1.2,
+    'road_primary': 1.0,
+    'road_secondary': 0.8,
+    'road_tertiary': 0.6,
+    'road_residential': 0.4,
+    'road_default': 0.4,
+}
+WATER_TAGS = {'natural': 'water', 'waterway': 'riverbank'}
+PARKS_TAGS = {'leisure': 'park', 'landuse': 'grass'}
+
+# Level of detail: the highway classes worth downloading at a given ground
+# resolution (metres per output pixel, upper bound first). Finer classes are
+# only sub-pixel noise at that scale, so they are never fetched or parsed.
+LOD_LEVELS = [
+    (2.0, None),
+    (6.0, ['motorway', 'trunk', 'primary', 'secondary', 'tertiary', 'residential',
+           'unclassified', 'living_street', 'service', 'pedestrian', 'road']),
+    (16.0, ['motorway', 'trunk', 'primary', 'secondary', 'tertiary', 'residential',
+            'unclassified', 'living_street', 'road']),
+    (float('inf'), ['motorway', 'trunk', 'primary', 'secondary', 'tertiary']),
+]
+
+# Drawing order for merged road paths: minor roads first, motorways on top.
+ROAD_CLASS_ORDER = [
+    'road_default',
+    'road_residential',
+    'road_tertiary',
+    'road_secondary',
+    'road_primary',
+    'road_motorway',
+]
 
 def load_fonts():
     """
@@ -42,7 +117,7 @@ def load_fonts():
 
 FONTS = load_fonts()
 
-def generate_output_filename(city, theme_name):
+def generate_output_filename(city, theme_name, output_format='png'):
     """
     Generate unique output filename with city, theme, and datetime.
     """
@@ -51,34 +126,72 @@ def generate_output_filename(city, theme_name):
     
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     city_slug = city.lower().replace(' ', '_')
-    filename = f"{city_slug}_{theme_name}_{timestamp}.png"
+    filename = f"{city_slug}_{theme_name}_{timestamp}.{output_format}"
     return os.path.join(POSTERS_DIR, filename)
 
+def parse_output_spec(text, default_format='png'):
+    """
+    Parses an output spec such as '18x24@300.pdf' (inches, DPI, format) into
+    a dict with figsize, dpi and format. DPI and format are optional and
+    default to OUTPUT_DPI and default_format. Raises ValueError if the spec
+    is malformed.
+    """
+    match = OUTPUT_SPEC_PATTERN.match(text.strip().lower())
+    if not match:
+        raise ValueError(f"Invalid output spec '{text}', expected WIDTHxHEIGHT[@DPI][.FORMAT], e.g. 18x24@300.pdf")
+    width, height, dpi, output_format = match.groups()
+    spec = {
+        'figsize': (float(width), float(height)),
+        'dpi': int(dpi) if dpi else OUTPUT_DPI,
+        'format': output_format or default_format,
+    }
+    if min(spec['figsize']) <= 0 or spec['dpi'] <= 0:
+        raise ValueError(f"Invalid output spec '{text}': size and DPI must be positive")
+    if spec['format'] not in OUTPUT_FORMATS:
+        raise ValueError(f"Invalid output spec '{text}': format must be one of {', '.join(OUTPUT_FORMATS)}")
+    return spec
+
+def variant_filename(output_file, spec):
+    """
+    Returns the file name of one output spec of a poster, e.g.
+    paris_noir_20240101_120000_18x24in_300dpi.pdf for paris_noir_20240101_120000.png.
+    """
+    stem, _ = os.path.splitext(output_file)
+    width, height = spec['figsize']
+    return f"{stem}_{width:g}x{height:g}in_{spec['dpi']}dpi.{spec['format']}"
+
+def _view_scale(figsize):
+    # A variant shows the standard poster's map extent scaled to cover it
+    # and cropped to its aspect ratio: the returned factor times the
+    # variant's size in inches gives the standard inches its map spans
+    # (1 at OUTPUT_FIGSIZE, and the full standard width or height).
+    return min(OUTPUT_FIGSIZE[0] / figsize[0], OUTPUT_FIGSIZE[1] / figsize[1])
+
+def detail_dpi(outputs):
+    """
+    Returns the DPI at the standard poster size that needs the same level of
+    detail as the finest of outputs (see get_lod_level).
+    """
+    return max(spec['dpi'] / _view_scale(spec['figsize']) for spec in outputs)
+
+THEMES = ThemeRegistry(THEMES_DIR)
+
 def get_available_themes():
     """
-    Scans the themes directory and returns a list of available theme names.
+    Returns the names of all valid themes in the themes directory.
     """
-    if not os.path.exists(THEMES_DIR):
-        os.makedirs(THEMES_DIR)
-        return []
-    
-    themes = []
-    for file in sorted(os.listdir(THEMES_DIR)):
-        if file.endswith('.json'):
-            theme_name = file[:-5]  # Remove .json extension
-            themes.append(theme_name)
-    return themes
+    return THEMES.names()
 
 def load_theme(theme_name="feature_based"):
     """
-    Load theme from JSON file in themes directory.
+    Returns the compiled theme (see theme_registry) for theme_name.
     """
-    theme_file = os.path.join(THEMES_DIR, f"{theme_name}.json")
-    
-    if not os.path.exists(theme_file):
+    theme = THEMES.get(theme_name)
+    if theme is None:
+        theme_file = os.path.join(THEMES_DIR, f"{theme_name}.json")
         print(f"⚠ Theme file '{theme_file}' not found. Using default feature_based theme.")
         # Fallback to embedded default theme
-        return {
+        return compile_theme("feature_based", {
             "name": "Feature-Based Shading",
             "bg": "#FFFFFF",
             "text": "#000000",
@@ -91,14 +204,14 @@ def load_theme(theme_name="feature_based"):
             "road_tertiary": "#3A3A3A",
             "road_residential": "#4A4A4A",
             "road_default": "#3A3A3A"
-        }
-    
-    with open(theme_file, 'r') as f:
-        theme = json.load(f)
-        print(f"✓ Loaded theme: {theme.get('name', theme_name)}")
-        if 'description' in theme:
-            print(f"  {theme['description']}")
-        return theme
+        })
+    return theme
+
+def theme_has_transparency(theme):
+    """
+    Returns True if any colour in the theme is not fully opaque.
+    """
+    return any(rgba[3] < 1 for rgba in theme['rgba'].values())
 
 def create_gradient_fade(ax, color, location='bottom', zorder=10):
     """
@@ -134,92 +247,324 @@ def create_gradient_fade(ax, color, location='bottom', zorder=10):
     ax.imshow(gradient, extent=[xlim[0], xlim[1], y_bottom, y_top], 
               aspect='auto', cmap=custom_cmap, zorder=zorder, origin='lower')
 
-def get_edge_colors_by_type(G, theme):
+def get_road_class(highway):
     """
-    Assigns colors to edges based on road type hierarchy.
-    Returns a list of colors corresponding to each edge in the graph.
+    Maps an OSM highway tag to the theme key of its road class.
     """
-    edge_colors = []
-    
-    for u, v, data in G.edges(data=True):
-        # Get the highway type (can be a list or string)
-        highway = data.get('highway', 'unclassified')
-        
-        # Handle list of highway types (take the first one)
-        if isinstance(highway, list):
-            highway = highway[0] if highway else 'unclassified'
-        
-        # Assign color based on road type
-        if highway in ['motorway', 'motorway_link']:
-            color = theme['road_motorway']
-        elif highway in ['trunk', 'trunk_link', 'primary', 'primary_link']:
-            color = theme['road_primary']
-        elif highway in ['secondary', 'secondary_link']:
-            color = theme['road_secondary']
-        elif highway in ['tertiary', 'tertiary_link']:
-            color = theme['road_tertiary']
-        elif highway in ['residential', 'living_street', 'unclassified']:
-            color = theme['road_residential']
-        else:
-            color = theme['road_default']
-        
-        edge_colors.append(color)
-    
-    return edge_colors
+    # Handle list of highway types (take the first one)
+    if isinstance(highway, list):
+        highway = highway[0] if highway else 'unclassified'
 
-def get_edge_widths_by_type(G):
+    if highway in ['motorway', 'motorway_link']:
+        return 'road_motorway'
+    elif highway in ['trunk', 'trunk_link', 'primary', 'primary_link']:
+        return 'road_primary'
+    elif highway in ['secondary', 'secondary_link']:
+        return 'road_secondary'
+    elif highway in ['tertiary', 'tertiary_link']:
+        return 'road_tertiary'
+    elif highway in ['residential', 'living_street', 'unclassified']:
+        return 'road_residential'
+    else:
+        return 'road_default'
+
+def _quantize_coords(coords, quantum):
     """
-    Assigns line widths to edges based on road type.
-    Major roads get thicker lines.
+    Snaps coordinates to a grid of size quantum and drops vertices that
+    collapse onto their predecessor. Returns integer grid coordinates.
     """
-    edge_widths = []
-    
-    for u, v, data in G.edges(data=True):
-        highway = data.get('highway', 'unclassified')
-        
-        if isinstance(highway, list):
-            highway = highway[0] if highway else 'unclassified'
-        
-        # Assign width based on road importance
-        if highway in ['motorway', 'motorway_link']:
-            width = 1.2
-        elif highway in ['trunk', 'trunk_link', 'primary', 'primary_link']:
-            width = 1.0
-        elif highway in ['secondary', 'secondary_link']:
-            width = 0.8
-        elif highway in ['tertiary', 'tertiary_link']:
-            width = 0.6
+    grid = np.round(np.asarray(coords)[:, :2] / quantum).astype(np.int64)
+    keep = np.ones(len(grid), dtype=bool)
+    keep[1:] = np.any(grid[1:] != grid[:-1], axis=1)
+    return grid[keep]
+
+def _merged_path(parts, quantum=1, closed=False):
+    """
+    Merges polylines (or closed rings) into a single compound Path.
+    """
+    lengths = np.array([len(part) for part in parts])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    codes = np.full(lengths.sum(), Path.LINETO, dtype=Path.code_type)
+    codes[starts] = Path.MOVETO
+    if closed:
+        codes[starts + lengths - 1] = Path.CLOSEPOLY
+    return Path(np.concatenate(parts) * quantum, codes)
+
+def _polygon_rings(gdf):
+    """
+    Returns the rings of all polygons in a GeoDataFrame, oriented so that
+    holes stay empty under matplotlib's nonzero fill rule.
+    """
+    rings = []
+    if gdf is None or gdf.empty:
+        return rings
+    for geom in gdf.geometry:
+        if geom is None:
+            continue
+        if geom.geom_type == 'Polygon':
+            polygons = [geom]
+        elif geom.geom_type == 'MultiPolygon':
+            polygons = geom.geoms
         else:
-            width = 0.4
-        
-        edge_widths.append(width)
-    
-    return edge_widths
+            continue
+        for polygon in polygons:
+            polygon = orient(polygon, 1.0)
+            for ring in [polygon.exterior, *polygon.interiors]:
+                rings.append(shapely.get_coordinates(ring))
+    return rings
+
+def pack_map_data(map_data):
+    """
+    Flattens a (G, water, parks) tuple into plain numpy arrays: road vertices
+    with per-edge offsets and road-class codes (indexes into ROAD_CLASS_ORDER),
+    polygon ring vertices with per-ring offsets and layer codes (0 water,
+    1 parks), and the map bounds. This is everything render_poster draws, so
+    the arrays can be shared between render processes (see shared_geometry)
+    instead of pickling the graph and GeoDataFrames for each of them.
+    """
+    G, water, parks = map_data
+    edges = ox.graph_to_gdfs(G, nodes=False)
+    bounds = edges.total_bounds
+
+    # u->v and v->u of a two-way street have the same geometry; keep one
+    u, v, key = (edges.index.get_level_values(level).to_numpy() for level in range(3))
+    twins = edges.assign(_a=np.minimum(u, v), _b=np.maximum(u, v), _key=key,
+                         _length=edges['length'].round(3))
+    edges = edges[~twins.duplicated(subset=['_a', '_b', '_key', '_length']).to_numpy()]
+
+    road_coords, index = shapely.get_coordinates(edges.geometry.to_numpy(), return_index=True)
+    road_offsets = np.concatenate(([0], np.cumsum(np.bincount(index, minlength=len(edges)))))
+    road_classes = np.array([ROAD_CLASS_ORDER.index(get_road_class(highway)) for highway in edges['highway']],
+                            dtype=np.uint8)
+
+    rings = []
+    ring_layers = []
+    for layer, gdf in enumerate((water, parks)):
+        layer_rings = _polygon_rings(gdf)
+        rings += layer_rings
+        ring_layers += [layer] * len(layer_rings)
+    ring_lengths = [len(ring) for ring in rings]
+
+    return {
+        'road_coords': road_coords.astype(np.float64),
+        'road_offsets': road_offsets.astype(np.int64),
+        'road_classes': road_classes,
+        'ring_coords': np.concatenate(rings) if rings else np.empty((0, 2)),
+        'ring_offsets': np.concatenate(([0], np.cumsum(ring_lengths))).astype(np.int64),
+        'ring_layers': np.array(ring_layers, dtype=np.uint8),
+        'bounds': np.asarray(bounds, dtype=np.float64),
+    }
+
+def _configure_map_axes(ax, bounds, padding=0.02):
+    """
+    Sets view limits and aspect the same way ox.plot_graph does, so vector
+    and raster posters frame the map identically.
+    """
+    left, bottom, right, top = bounds
+    pad_ns = (top - bottom) * padding
+    pad_ew = (right - left) * padding
+    ax.set_ylim((bottom - pad_ns, top + pad_ns))
+    ax.set_xlim((left - pad_ew, right + pad_ew))
+    ax.margins(0)
+    ax.tick_params(which="both", direction="in")
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    ax.get_xaxis().set_visible(False)
+    ax.get_yaxis().set_visible(False)
+    ax.set_aspect(1 / np.cos(np.deg2rad((bottom + top) / 2)))
+
+def _packed_lines(coords, offsets, selected):
+    return [coords[offsets[i]:offsets[i + 1]] for i in selected]
+
+def plot_map_layers(ax, packed, theme, vector=False):
+    """
+    Draws water, parks and roads from pack_map_data arrays. Each layer and
+    road class becomes one artist: a compound path for polygons, and a
+    LineCollection per road class for raster output.
+
+    For vector output roads are merged into one path per class as well, and
+    coordinates are snapped to a grid finer than print resolution, which
+    keeps SVG and PDF output compact.
+    """
+    bounds = packed['bounds']
+    quantum = (bounds[2] - bounds[0]) / (OUTPUT_FIGSIZE[0] * VECTOR_GRID_DPI)
+
+    def prepare(lines, min_vertices):
+        if vector:
+            lines = [_quantize_coords(line, quantum) for line in lines]
+        return [line for line in lines if len(line) >= min_vertices]
+
+    # Roads share zorder 1 with water and are drawn after it, parks sit on
+    # top at zorder 2.
+    for layer, (key, zorder) in enumerate((('water', 1), ('parks', 2))):
+        rings = prepare(_packed_lines(packed['ring_coords'], packed['ring_offsets'],
+                                      np.flatnonzero(packed['ring_layers'] == layer)), 4)
+        if rings:
+            ax.add_patch(PathPatch(_merged_path(rings, quantum if vector else 1, closed=True),
+                                   facecolor=theme['rgba'][key], edgecolor='none', zorder=zorder))
+
+    seen = set()
+    for code, road_class in enumerate(ROAD_CLASS_ORDER):
+        lines = prepare(_packed_lines(packed['road_coords'], packed['road_offsets'],
+                                      np.flatnonzero(packed['road_classes'] == code)), 2)
+        if vector:
+            # Edges that only differ below grid resolution collapse into one
+            unique = []
+            for grid in lines:
+                if tuple(grid[-1]) < tuple(grid[0]):
+                    grid = grid[::-1]
+                key = grid.tobytes()
+                if key not in seen:
+                    seen.add(key)
+                    unique.append(grid)
+            if unique:
+                ax.add_patch(PathPatch(_merged_path(unique, quantum),
+                                       facecolor='none', edgecolor=theme['rgba'][road_class],
+                                       linewidth=ROAD_WIDTHS[road_class], zorder=1))
+        elif lines:
+            ax.add_collection(LineCollection(lines, colors=[theme['rgba'][road_class]],
+                                             linewidths=ROAD_WIDTHS[road_class], zorder=1),
+                              autolim=False)
+
+    _configure_map_axes(ax, bounds)
+
+def _vector_metadata(metadata, output_format):
+    """
+    Maps poster metadata onto the fixed keys SVG and PDF writers accept.
+    """
+    title = f"{metadata['City']}, {metadata['Country']}"
+    description = (
+        f"Theme: {metadata['Theme']}; Distance: {metadata['DistanceMeters']} m; "
+        f"Coordinates: {metadata['Latitude']}, {metadata['Longitude']}"
+    )
+    if output_format == 'svg':
+        return {
+            "Title": title,
+            "Description": description,
+            "Date": metadata["GeneratedAt"],
+            "Creator": metadata["Title"],
+            "Source": metadata["Source"],
+        }
+    return {
+        "Title": title,
+        "Subject": description,
+        "Creator": metadata["Title"],
+        "Keywords": metadata["Source"],
+    }
+
+def nominatim_delay():
+    """
+    Books this process's next Nominatim request slot and returns the
+    seconds to wait before sending the request. get_coordinates and the web
+    UI's async geocoder both book here, so together they keep to the limit.
+    """
+    global _nominatim_next
+    with _nominatim_lock:
+        now = time.monotonic()
+        start = max(now, _nominatim_next)
+        _nominatim_next = start + NOMINATIM_INTERVAL_SECONDS
+    return start - now
 
 def get_coordinates(city, country):
     """
-    Fetches coordinates for a given city and country using geopy.
+    Fetches coordinates for a given city and country from the offline
+    gazetteer if it has been built, then from the geocode cache, otherwise
+    using geopy and caching the result.
     Includes rate limiting to be respectful to the geocoding service.
     """
     print("Looking up coordinates...")
+    place = gazetteer.lookup(city, country)
+    if place:
+        print(f"✓ Found: {place['name']}, {place['country']} (offline gazetteer)")
+        print(f"✓ Coordinates: {place['lat']}, {place['lon']}")
+        return (place['lat'], place['lon'])
+    cached = geocode_cache.lookup(city, country)
+    if cached:
+        print(f"✓ Found: {cached['address']} (cached)")
+        print(f"✓ Coordinates: {cached['lat']}, {cached['lon']}")
+        return (cached['lat'], cached['lon'])
+
+    url = urlsplit(NOMINATIM_URL)
     ssl_context = ssl.create_default_context(cafile=certifi.where())
-    geolocator = Nominatim(user_agent="city_map_poster", ssl_context=ssl_context)
+    geolocator = Nominatim(
+        user_agent="city_map_poster",
+        ssl_context=ssl_context,
+        domain=url.netloc + url.path.removesuffix('/search'),
+        scheme=url.scheme,
+    )
     
     # Add a small delay to respect Nominatim's usage policy
-    time.sleep(1)
+    if url.hostname == 'nominatim.openstreetmap.org':
+        time.sleep(nominatim_delay())
     
     location = geolocator.geocode(f"{city}, {country}")
     
     if location:
         print(f"✓ Found: {location.address}")
         print(f"✓ Coordinates: {location.latitude}, {location.longitude}")
+        geocode_cache.store(city, country, location.latitude, location.longitude, location.address)
         return (location.latitude, location.longitude)
     else:
         raise ValueError(f"Could not find coordinates for {city}, {country}")
 
-def create_poster(city, country, point, dist, output_file, theme, show_progress=True):
-    print(f"\nGenerating map for {city}, {country}...")
-    
+def get_lod_level(dist, dpi=OUTPUT_DPI):
+    """
+    Returns the index of the LOD_LEVELS entry for the map's ground resolution
+    at the given output DPI; dpi=None means full detail.
+    """
+    if not dpi:
+        return 0
+    meters_per_pixel = 2 * dist / (OUTPUT_FIGSIZE[0] * dpi)
+    for level, (max_meters_per_pixel, _) in enumerate(LOD_LEVELS):
+        if meters_per_pixel <= max_meters_per_pixel:
+            return level
+    return len(LOD_LEVELS) - 1
+
+def get_network_filter(dist, dpi=OUTPUT_DPI):
+    """
+    Picks an Overpass highway filter from the map's ground resolution at the
+    given output DPI (see LOD_LEVELS). Returns None when every road class is
+    visible and the full network should be downloaded.
+    """
+    highways = LOD_LEVELS[get_lod_level(dist, dpi)][1]
+    if highways is None:
+        return None
+    return f'["highway"~"^({"|".join(highways)})(_link)?$"]["area"!~"yes"]'
+
+def fetch_features(point, dist, layer, tags, delay=0):
+    """
+    Returns a feature layer around a point from the GeoParquet cache, or
+    downloads it (after a rate-limiting delay) and caches it.
+    Returns None when there are no such features or the download fails.
+    """
+    cached = feature_cache.load_features(layer, tags, point, dist)
+    if cached is not feature_cache.MISS:
+        return cached
+
+    time.sleep(delay)  # Rate limit between requests
+    try:
+        features = ox.features_from_point(point, tags=tags, dist=dist)
+    except InsufficientResponseError:
+        features = None
+    except Exception:
+        # Transient failures are not cached
+        return None
+    feature_cache.store_features(layer, tags, point, dist, features)
+    return features
+
+def fetch_map_data(point, dist, show_progress=True, dpi=OUTPUT_DPI, checkpoint=None):
+    """
+    Downloads the street network, water and park features around a point.
+    Returns a (G, water, parks) tuple that can be rendered any number of times,
+    e.g. once per theme.
+    Road classes too fine to see at dpi are skipped; pass dpi=None to
+    download the full network. checkpoint, if given, is called with the
+    name of the next layer between downloads (see create_poster).
+    """
+    network_filter = get_network_filter(dist, dpi) if dpi else None
+    if network_filter:
+        print(f"✓ Level of detail: {2 * dist / (OUTPUT_FIGSIZE[0] * dpi):.1f} m/pixel, fetching {network_filter}")
+
     # Progress bar for data fetching
     with tqdm(
         total=3,
@@ -230,58 +575,236 @@ def create_poster(city, country, point, dist, output_file, theme, show_progress=
     ) as pbar:
         # 1. Fetch Street Network
         pbar.set_description("Downloading street network")
-        G = ox.graph_from_point(point, dist=dist, dist_type='bbox', network_type='all')
+        if network_filter:
+            # Keep every component: dropping minor roads can split the network
+            # and we still want to draw the pieces.
+            G = ox.graph_from_point(point, dist=dist, dist_type='bbox',
+                                    custom_filter=network_filter, retain_all=True)
+        else:
+            G = ox.graph_from_point(point, dist=dist, dist_type='bbox', network_type='all')
         pbar.update(1)
-        time.sleep(0.5)  # Rate limit between requests
+        if checkpoint:
+            checkpoint('water')
         
         # 2. Fetch Water Features
         pbar.set_description("Downloading water features")
-        try:
-            water = ox.features_from_point(point, tags={'natural': 'water', 'waterway': 'riverbank'}, dist=dist)
-        except:
-            water = None
+        water = fetch_features(point, dist, 'water', WATER_TAGS, delay=0.5)
         pbar.update(1)
-        time.sleep(0.3)
+        if checkpoint:
+            checkpoint('parks')
         
         # 3. Fetch Parks
         pbar.set_description("Downloading parks/green spaces")
-        try:
-            parks = ox.features_from_point(point, tags={'leisure': 'park', 'landuse': 'grass'}, dist=dist)
-        except:
-            parks = None
+        parks = fetch_features(point, dist, 'parks', PARKS_TAGS, delay=0.3)
         pbar.update(1)
     
     print("✓ All data downloaded successfully!")
-    
-    # 2. Setup Plot
-    print("Rendering map...")
+    return G, water, parks
+
+def save_png(fig, output_file, metadata, facecolor, compression='balanced', mode='rgba', dpi=OUTPUT_DPI):
+    """
+    Rasterizes the figure at dpi and encodes it with Pillow.
+    compression picks a zlib level from PNG_COMPRESSION_LEVELS; mode is
+    'rgba', 'rgb' (drops the alpha channel) or 'palette' (256 colours).
+    The text chunks read back by the web UI are written as PNG metadata.
+    """
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='raw', dpi=dpi, facecolor=facecolor)
+    width = int(fig.get_figwidth() * dpi)
+    height = buffer.getbuffer().nbytes // (4 * width)
+    image = Image.frombuffer('RGBA', (width, height), buffer.getbuffer(), 'raw', 'RGBA', 0, 1)
+
+    if mode == 'rgb':
+        image = image.convert('RGB')
+    elif mode == 'palette':
+        image = image.convert('RGB').quantize(
+            colors=256, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE
+        )
+
+    info = PngInfo()
+    for key, value in {"Software": f"Matplotlib version{matplotlib.__version__}, https://matplotlib.org/",
+                       **metadata}.items():
+        info.add_text(key, value)
+    image.save(output_file, format='PNG', pnginfo=info, dpi=(dpi, dpi),
+               compress_level=PNG_COMPRESSION_LEVELS[compression])
+
+def optimize_png(path, lock=None):
+    """
+    Re-encodes a PNG at maximum compression, keeping its text metadata and
+    DPI. The original is replaced atomically, and only if the result is
+    smaller and still in place; lock, if given, is held while checking and
+    replacing it, so code that moves posters can hold it too. Returns the
+    number of bytes saved.
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        with Image.open(path) as image:
+            image.load()
+            info = PngInfo()
+            for key, value in image.text.items():
+                info.add_text(key, value)
+            image.save(tmp_path, format='PNG', pnginfo=info, dpi=image.info.get('dpi', (OUTPUT_DPI, OUTPUT_DPI)),
+                       optimize=True)
+
+        saved = os.path.getsize(path) - os.path.getsize(tmp_path)
+        with lock or nullcontext():
+            # The poster may have been moved (e.g. to the trash) while re-encoding
+            if saved > 0 and os.path.exists(path):
+                os.replace(tmp_path, path)
+                return saved
+        return 0
+    finally:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+
+def _select_parts(coords, offsets, low, high):
+    """
+    Returns a mask of the parts (roads or rings) whose latitude range
+    overlaps [low, high].
+    """
+    counts = np.diff(offsets)
+    if not len(counts):
+        return np.zeros(0, dtype=bool)
+    starts = np.asarray(offsets[:-1])
+    lats = np.asarray(coords)[:, 1]
+    return (np.maximum.reduceat(lats, starts) >= low) & (np.minimum.reduceat(lats, starts) <= high)
+
+def _subset_parts(coords, offsets, mask):
+    counts = np.diff(offsets)
+    kept = np.repeat(mask, counts)
+    return np.asarray(coords)[kept], np.concatenate(([0], np.cumsum(counts[mask]))).astype(np.int64)
+
+def render_band(geometry_path, buffer_path, theme, layout, top, bottom):
+    """
+    Process pool entry point for split rendering (see render_map_bands):
+    rasterizes pixel rows top to bottom of the poster's map from shared
+    geometry, drawing only the roads and polygons that reach into them, and
+    writes them into the shared output buffer.
+    """
+    packed = shared_geometry.attach(geometry_path)
+    dpi = layout['dpi']
+    figure_width, figure_height = layout['figure_px']
+    axes_x, axes_y, axes_width, axes_height = layout['axes_px']
+    y_low, y_high = layout['ylim']
+
+    # The rows' latitude range, widened by the widest road so lines
+    # centred just outside the band still paint their edge into it
+    margin = max(ROAD_WIDTHS.values()) * layout['line_scale'] * dpi / 72
+    def latitude(display_y):
+        return y_low + (display_y - axes_y) / axes_height * (y_high - y_low)
+    low = latitude(figure_height - bottom - margin)
+    high = latitude(figure_height - top + margin)
+
+    band = {'bounds': packed['bounds']}
+    roads = _select_parts(packed['road_coords'], packed['road_offsets'], low, high)
+    band['road_coords'], band['road_offsets'] = _subset_parts(packed['road_coords'], packed['road_offsets'], roads)
+    band['road_classes'] = np.asarray(packed['road_classes'])[roads]
+    rings = _select_parts(packed['ring_coords'], packed['ring_offsets'], low, high)
+    band['ring_coords'], band['ring_offsets'] = _subset_parts(packed['ring_coords'], packed['ring_offsets'], rings)
+    band['ring_layers'] = np.asarray(packed['ring_layers'])[rings]
+
+    # Agg truncates the canvas to whole pixels and flips y around the exact
+    # figure height, so the band keeps the figure's fractional pixel to line
+    # up with its neighbours.
+    rows = bottom - top
+    band_height = rows + (figure_height - int(figure_height)) + 1e-9
+    fig = plt.figure(figsize=(figure_width / dpi, band_height / dpi), dpi=dpi, facecolor=theme['bg'])
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_facecolor(theme['bg'])
+    plot_map_layers(ax, band, theme)
+    for collection in ax.collections:
+        collection.set_linewidth(np.asarray(collection.get_linewidth()) * layout['line_scale'])
+    ax.set_aspect('auto')
+    ax.set_xlim(layout['xlim'])
+    ax.set_ylim(layout['ylim'])
+    offset = figure_height - top - band_height
+    ax.set_position([axes_x / figure_width, (axes_y - offset) / band_height,
+                     axes_width / figure_width, axes_height / band_height])
+    fig.canvas.draw()
+    pixels = np.asarray(fig.canvas.buffer_rgba())
+
+    output = shared_geometry.attach(buffer_path, writable=True)['image']
+    output[top:bottom] = pixels[:rows]
+    output.flush()
+    plt.close(fig)
+
+def render_map_bands(packed, theme, fig, ax, executor, bands, geometry_path=None, line_scale=1):
+    """
+    Rasterizes the map of a poster whose axes are already framed (see
+    _configure_map_axes) in horizontal bands, one render_band task per band
+    on executor, and adds the stitched RGBA image of the whole figure at its
+    current size and DPI to fig as a figure image behind everything else;
+    returns that image. Road widths are multiplied by line_scale.
+    Run more bands than workers: the middle of a city is far busier than
+    its edges, and smaller tasks keep every worker busy to the end.
+    """
+    ax.apply_aspect()
+    position = ax.get_position()
+    figure_width, figure_height = fig.bbox.width, fig.bbox.height
+    layout = {
+        'figure_px': (figure_width, figure_height),
+        'axes_px': (position.x0 * figure_width, position.y0 * figure_height,
+                    position.width * figure_width, position.height * figure_height),
+        'xlim': ax.get_xlim(),
+        'ylim': ax.get_ylim(),
+        'dpi': fig.dpi,
+        'line_scale': line_scale,
+    }
+    height, width = int(figure_height), int(figure_width)
+    edges = np.linspace(0, height, bands + 1).astype(int)
+
+    published = geometry_path is None
+    if published:
+        geometry_path = shared_geometry.publish(packed)
+    buffer_path = shared_geometry.allocate('image', (height, width, 4))
+    try:
+        futures = [executor.submit(render_band, geometry_path, buffer_path, theme, layout, top, bottom)
+                   for top, bottom in zip(edges[:-1], edges[1:]) if bottom > top]
+        for future in futures:
+            future.result()
+        # figimage keeps a copy of its own, so the shared buffer is mapped,
+        # not copied again, and can go right away
+        return fig.figimage(shared_geometry.attach(buffer_path)['image'], origin='upper', zorder=-1)
+    finally:
+        shared_geometry.release(buffer_path)
+        if published:
+            shared_geometry.release(geometry_path)
+
+def _build_scene(city, country, point, packed, theme, vector=False, draw_map=True):
+    """
+    Draws a poster at OUTPUT_FIGSIZE: the map layers (left out with
+    draw_map=False, for split rendering), the gradients and the text.
+    Returns the figure, its axes and the artists that _layout_scene fits to
+    other output sizes, with their standard positions and sizes.
+    """
     fig, ax = plt.subplots(figsize=OUTPUT_FIGSIZE, facecolor=theme['bg'])
     ax.set_facecolor(theme['bg'])
     ax.set_position([0, 0, 1, 1])
     
     # 3. Plot Layers
-    # Layer 1: Polygons
-    if water is not None and not water.empty:
-        water.plot(ax=ax, facecolor=theme['water'], edgecolor='none', zorder=1)
-    if parks is not None and not parks.empty:
-        parks.plot(ax=ax, facecolor=theme['parks'], edgecolor='none', zorder=2)
-    
-    # Layer 2: Roads with hierarchy coloring
-    print("Applying road hierarchy colors...")
-    edge_colors = get_edge_colors_by_type(G, theme)
-    edge_widths = get_edge_widths_by_type(G)
-    
-    ox.plot_graph(
-        G, ax=ax, bgcolor=theme['bg'],
-        node_size=0,
-        edge_color=edge_colors,
-        edge_linewidth=edge_widths,
-        show=False, close=False
-    )
+    if draw_map:
+        plot_map_layers(ax, packed, theme, vector=vector)
+    else:
+        _configure_map_axes(ax, packed['bounds'])
+        # The gradients below are drawn with imshow(aspect='auto'), which
+        # stretches the map over the whole axes; frame the bands that way.
+        ax.set_aspect('auto')
+        # The bands already hold the background, so nothing is drawn under
+        # them: a translucent background would otherwise be applied twice.
+        fig.set_facecolor('none')
+        ax.set_facecolor('none')
+    map_artists = list(ax.collections) + list(ax.patches)
     
     # Layer 3: Gradients (Top and Bottom)
     create_gradient_fade(ax, theme['gradient_color'], location='bottom', zorder=10)
     create_gradient_fade(ax, theme['gradient_color'], location='top', zorder=10)
+    if vector:
+        # Embed the 256-step gradients as-is and let the viewer scale them,
+        # instead of resampling them to OUTPUT_DPI inside the file.
+        for image in ax.get_images():
+            image.set_interpolation('none')
     
     # 4. Typography using Roboto font
     if FONTS:
@@ -351,7 +874,90 @@ def create_poster(city, country, point, dist, output_file, theme, show_progress=
             color=theme['text'], alpha=0.5, ha='right', va='bottom', 
             fontproperties=font_attr, zorder=11)
 
-    # 5. Save
+    return {
+        'fig': fig,
+        'ax': ax,
+        'xlim': ax.get_xlim(),
+        'ylim': ax.get_ylim(),
+        'line_widths': [(artist, artist.get_linewidth()) for artist in map_artists],
+        'gradients': [(image, image.get_extent()) for image in ax.get_images()],
+        'texts': [(text, text.get_position(), text.get_fontsize()) for text in ax.texts],
+        'lines': [(line, line.get_xdata(), line.get_ydata(), line.get_linewidth()) for line in ax.lines],
+    }
+
+def _layout_scene(scene, figsize):
+    """
+    Resizes a scene from _build_scene to figsize (inches). The standard
+    poster's map extent is scaled to cover the new size and cropped around
+    its centre to the new aspect ratio; text, rules and road widths scale
+    with the poster's tighter side, and the text block keeps its distance
+    from the bottom edge in those units. Returns that scale.
+    """
+    fig, ax = scene['fig'], scene['ax']
+    width, height = figsize
+    fig.set_size_inches(width, height)
+    scale = min(width / OUTPUT_FIGSIZE[0], height / OUTPUT_FIGSIZE[1])
+    x_factor = OUTPUT_FIGSIZE[0] * scale / width
+    y_factor = OUTPUT_FIGSIZE[1] * scale / height
+
+    view = _view_scale(figsize)
+    limits = []
+    for (low, high), inches, standard in ((scene['xlim'], width, OUTPUT_FIGSIZE[0]),
+                                          (scene['ylim'], height, OUTPUT_FIGSIZE[1])):
+        centre = (low + high) / 2
+        half_span = (high - low) * inches / standard * view / 2
+        limits.append((centre - half_span, centre + half_span))
+    ax.set_xlim(limits[0])
+    ax.set_ylim(limits[1])
+
+    # Gradients cover the same fraction of the (cropped) map
+    y0, y1 = scene['ylim']
+    (left, right), (bottom, top) = limits
+    for image, (_, _, image_bottom, image_top) in scene['gradients']:
+        image.set_extent([left, right,
+                          bottom + (image_bottom - y0) / (y1 - y0) * (top - bottom),
+                          bottom + (image_top - y0) / (y1 - y0) * (top - bottom)])
+
+    for artist, line_width in scene['line_widths']:
+        artist.set_linewidth(np.asarray(line_width) * scale)
+    for text, (x, y), size in scene['texts']:
+        text.set_position((0.5 + (x - 0.5) * x_factor, y * y_factor))
+        text.set_fontsize(size * scale)
+    for line, xs, ys, line_width in scene['lines']:
+        line.set_data(0.5 + (np.asarray(xs) - 0.5) * x_factor, np.asarray(ys) * y_factor)
+        line.set_linewidth(line_width * scale)
+    return scale
+
+def render_poster(city, country, point, dist, output_file, theme, map_data,
+                  png_compression='balanced', png_mode='auto', checkpoint=None,
+                  executor=None, bands=0, geometry_path=None, outputs=None):
+    """
+    Renders previously fetched map data (see fetch_map_data) to output_file.
+    map_data is a (G, water, parks) tuple or its pack_map_data arrays, e.g.
+    attached from shared memory in a render process.
+    png_compression and png_mode control PNG encoding (see save_png); in
+    'auto' mode the alpha channel is dropped unless the theme uses it.
+    checkpoint, if given, is called with the name of the next stage
+    ('save') once the map is drawn; a scheduler may block in it to let more
+    urgent work run first.
+    With a process pool executor and bands > 1, a raster map is split into
+    that many bands drawn in parallel (see render_map_bands); gradients and
+    text are then drawn over the stitched image. geometry_path, if the data
+    is already published with shared_geometry, saves publishing it again.
+    outputs, if given, is a list of output specs (see parse_output_spec),
+    each with the 'file' to write, which replaces output_file at
+    OUTPUT_FIGSIZE and OUTPUT_DPI. The poster is drawn once for all raster
+    and once for all vector specs, and laid out for each (see
+    _layout_scene). Returns the files written.
+    """
+    packed = map_data if isinstance(map_data, dict) else pack_map_data(map_data)
+    if 'rgba' not in theme:
+        theme = compile_theme(theme.get('id', ''), theme)
+    if outputs is None:
+        output_format = os.path.splitext(output_file)[1].lstrip('.').lower() or 'png'
+        outputs = [{'file': output_file, 'figsize': OUTPUT_FIGSIZE, 'dpi': OUTPUT_DPI, 'format': output_format}]
+    if png_mode == 'auto':
+        png_mode = 'rgba' if theme_has_transparency(theme) else 'rgb'
     metadata = {
         "Title": "Map Poster Studio",
         "City": city,
@@ -364,10 +970,88 @@ def create_poster(city, country, point, dist, output_file, theme, show_progress=
         "GeneratedAt": datetime.now().isoformat(timespec="seconds"),
         "Source": "OpenStreetMap contributors",
     }
-    print(f"Saving to {output_file}...")
-    plt.savefig(output_file, dpi=OUTPUT_DPI, facecolor=theme['bg'], metadata=metadata)
-    plt.close()
-    print(f"✓ Done! Poster saved as {output_file}")
+
+    published = None
+    saving = False
+    try:
+        for is_vector in (False, True):
+            specs = [spec for spec in outputs if (spec['format'] in VECTOR_FORMATS) == is_vector]
+            if not specs:
+                continue
+            split = executor is not None and bands > 1 and not is_vector
+
+            # 2. Setup Plot
+            print("Rendering map...")
+            if split:
+                print(f"Rasterizing the map in {bands} bands...")
+                if geometry_path is None and len(specs) > 1:
+                    geometry_path = published = shared_geometry.publish(packed)
+            elif is_vector:
+                print("Merging layers into vector paths...")
+            else:
+                print("Applying road hierarchy colors...")
+            scene = _build_scene(city, country, point, packed, theme, vector=is_vector, draw_map=not split)
+            fig = scene['fig']
+
+            # 5. Save
+            if checkpoint and not saving:
+                checkpoint('save')
+            saving = True
+            try:
+                for spec in specs:
+                    scale = _layout_scene(scene, spec['figsize'])
+                    print(f"Saving to {spec['file']}...")
+                    if is_vector:
+                        # TrueType subsets in PDF, glyph outlines defined once in SVG
+                        with plt.rc_context({'pdf.fonttype': 42, 'svg.fonttype': 'path'}):
+                            fig.savefig(spec['file'], format=spec['format'], dpi=spec['dpi'],
+                                        facecolor=theme['bg'],
+                                        metadata=_vector_metadata(metadata, spec['format']))
+                    elif split:
+                        fig.set_dpi(spec['dpi'])
+                        map_image = render_map_bands(packed, theme, fig, scene['ax'], executor, bands,
+                                                     geometry_path, line_scale=scale)
+                        save_png(fig, spec['file'], metadata, 'none', compression=png_compression,
+                                 mode=png_mode, dpi=spec['dpi'])
+                        map_image.remove()
+                    else:
+                        save_png(fig, spec['file'], metadata, theme['bg'], compression=png_compression,
+                                 mode=png_mode, dpi=spec['dpi'])
+                    print(f"✓ Done! Poster saved as {spec['file']}")
+            finally:
+                plt.close(fig)
+    finally:
+        if published:
+            shared_geometry.release(published)
+    return [spec['file'] for spec in outputs]
+
+def render_shared_poster(geometry_path, city, country, point, dist, output_file, theme, **kwargs):
+    """
+    Process pool entry point: renders from geometry published with
+    shared_geometry.publish, mapping it read-only instead of unpickling it.
+    """
+    render_poster(city, country, point, dist, output_file, theme,
+                  shared_geometry.attach(geometry_path), **kwargs)
+
+def create_poster(city, country, point, dist, output_file, theme, show_progress=True,
+                  png_compression='balanced', png_mode='auto', full_detail=False, checkpoint=None,
+                  executor=None, bands=0, outputs=None):
+    """
+    Fetches and renders a poster. checkpoint, if given, is called between
+    the fetch, draw and save stages; executor and bands split the raster
+    map across processes, and outputs saves several sizes and formats at
+    once (see render_poster). The level of detail fetched suits the finest
+    output. Returns the files written.
+    """
+    print(f"\nGenerating map for {city}, {country}...")
+    map_data = fetch_map_data(point, dist, show_progress=show_progress,
+                              dpi=None if full_detail else detail_dpi(outputs or [
+                                  {'figsize': OUTPUT_FIGSIZE, 'dpi': OUTPUT_DPI}]))
+    if checkpoint:
+        checkpoint('draw')
+    return render_poster(city, country, point, dist, output_file, theme, map_data,
+                         png_compression=png_compression, png_mode=png_mode, checkpoint=checkpoint,
+                         executor=executor, bands=bands, outputs=outputs)
 
 def print_examples():
     """Print usage examples."""
@@ -414,6 +1098,13 @@ Options:
   --country, -C     Country name (required)
   --theme, -t       Theme name (default: feature_based)
   --distance, -d    Map radius in meters (default: 29000)
+  --format, -f      Output format: png, svg or pdf (default: png)
+  --png-compression PNG encoder speed/size: fast, balanced, small (default: balanced)
+  --png-mode        PNG pixels: auto, rgba, rgb, palette (default: auto)
+  --optimize        Recompress the PNG at maximum compression after saving
+  --full-detail     Download every road class, even those too fine to see
+  --size            Output size WIDTHxHEIGHT[@DPI][.FORMAT] in inches, e.g. 18x24@300.pdf;
+                    repeat to save several sizes and formats from one render
   --list-themes     List all available themes
 
 Distance guide:
@@ -459,6 +1150,7 @@ Examples:
   python create_map_poster.py --city "New York" --country "USA"
   python create_map_poster.py --city Tokyo --country Japan --theme midnight_blue
   python create_map_poster.py --city Paris --country France --theme noir --distance 15000
+  python create_map_poster.py --city Paris --country France --size 12x16@300 --size 24x36@150.pdf
   python create_map_poster.py --list-themes
         """
     )
@@ -467,6 +1159,14 @@ Examples:
     parser.add_argument('--country', '-C', type=str, help='Country name')
     parser.add_argument('--theme', '-t', type=str, default='feature_based', help='Theme name (default: feature_based)')
     parser.add_argument('--distance', '-d', type=int, default=29000, help='Map radius in meters (default: 29000)')
+    parser.add_argument('--format', '-f', type=str, default='png', choices=OUTPUT_FORMATS, help='Output format: png, svg or pdf (default: png)')
+    parser.add_argument('--png-compression', type=str, default='balanced', choices=list(PNG_COMPRESSION_LEVELS), help='PNG encoder speed/size tradeoff (default: balanced)')
+    parser.add_argument('--png-mode', type=str, default='auto', choices=PNG_MODES, help='PNG pixel format; auto drops alpha unless the theme uses it (default: auto)')
+    parser.add_argument('--optimize', action='store_true', help='Recompress the PNG at maximum compression after saving')
+    parser.add_argument('--full-detail', action='store_true', help='Download every road class, even those too fine to see at this distance')
+    parser.add_argument('--size', action='append', metavar='SPEC', help='Output size WIDTHxHEIGHT[@DPI][.FORMAT] in inches, e.g. 18x24@300.pdf; repeat for several (default: one poster in --format)')
+    parser.add_argument('--processes', type=int, default=1, help='Rasterize the map in this many processes (PNG only, default: 1)')
+    parser.add_argument('--profile', action='store_true', help='Save a CPU profile, sampled stacks and an allocation snapshot next to the poster')
     parser.add_argument('--list-themes', action='store_true', help='List all available themes')
     
     args = parser.parse_args()
@@ -494,6 +1194,12 @@ Examples:
         print(f"Available themes: {', '.join(available_themes)}")
         os.sys.exit(1)
     
+    try:
+        outputs = [parse_output_spec(spec, args.format) for spec in args.size or []]
+    except ValueError as e:
+        print(f"Error: {e}")
+        os.sys.exit(1)
+    
     print("=" * 50)
     print("Map Poster Studio")
     print("=" * 50)
@@ -503,9 +1209,27 @@ Examples:
     
     # Get coordinates and generate poster
     try:
-        coords = get_coordinates(args.city, args.country)
-        output_file = generate_output_filename(args.city, args.theme)
-        create_poster(args.city, args.country, coords, args.distance, output_file, theme)
+        output_file = generate_output_filename(args.city, args.theme, args.format)
+        for spec in outputs:
+            spec['file'] = variant_filename(output_file, spec)
+        executor = ProcessPoolExecutor(max_workers=args.processes) if args.processes > 1 else None
+        with (profiling.profile_run(output_file) if args.profile else nullcontext()) as profile:
+            coords = get_coordinates(args.city, args.country)
+            output_files = create_poster(args.city, args.country, coords, args.distance, output_file, theme,
+                                         png_compression=args.png_compression, png_mode=args.png_mode,
+                                         full_detail=args.full_detail, executor=executor,
+                                         bands=args.processes * BANDS_PER_PROCESS, outputs=outputs or None)
+        if executor:
+            executor.shutdown()
+        if profile:
+            print(f"✓ Profile saved ({profile['seconds']:.1f}s, peak {profile['peak_traced_mb']} MB traced):")
+            for kind in profiling.PROFILE_SUFFIXES:
+                print(f"  {profile[kind]}")
+        for path in output_files:
+            if args.optimize and path.endswith('.png'):
+                print(f"Optimizing {path}...")
+                saved = optimize_png(path)
+                print(f"✓ Saved {saved / 1e6:.1f} MB")
         
         print("\n" + "=" * 50)
         print("✓ Poster generation complete!")
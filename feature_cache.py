@@ -0,0 +1,190 @@
+"""
+On-disk cache of OSM feature layers (water, parks) as GeoParquet files.
+
+Each layer download is stored once with a bbox covering column, and the
+area it covers is recorded in a small JSON index. A later request for the
+same tags whose bbox lies inside a cached area is answered by reading just
+the intersecting rows: pyarrow pushes the bbox filter down to the Parquet
+row groups and memory-maps the file instead of re-downloading and
+re-parsing Overpass JSON.
+
+The index is held in memory and only re-read when its file changes, e.g.
+after a CLI run. Whenever it is read, stale entries are dropped together
+with their files, and so are Parquet files no entry refers to.
+
+GeoParquet support needs pyarrow. Without it every lookup is a miss and
+nothing is written, so callers behave exactly as if there were no cache.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+import geopandas as gpd
+import osmnx as ox
+
+try:
+    import pyarrow  # noqa: F401 - required by GeoDataFrame.to_parquet/read_parquet
+except ImportError:
+    pyarrow = None
+
+FEATURE_CACHE_DIR = os.path.join("cache", "features")
+INDEX_FILE = os.path.join(FEATURE_CACHE_DIR, "index.json")
+MAX_AGE_DAYS = 30
+# Files no index entry refers to are kept this long, since another process
+# writes its file before adding the entry
+ORPHAN_GRACE_SECONDS = 60 * 60
+
+# Returned by load_features when the cache cannot answer the request, to tell
+# it apart from a cached "no features here" (None).
+MISS = object()
+
+_lock = threading.Lock()
+_index = None
+_index_mtime = None
+
+
+def _index_file_mtime():
+    try:
+        return os.stat(INDEX_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _prune(entries, now):
+    # Drops stale entries and deletes their files and orphaned ones
+    kept = [entry for entry in entries if _is_fresh(entry, now)]
+    for entry in entries:
+        if entry["path"] and not _is_fresh(entry, now):
+            _remove_file(entry["path"])
+    referenced = {os.path.basename(entry["path"]) for entry in kept if entry["path"]}
+    try:
+        names = os.listdir(FEATURE_CACHE_DIR)
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        path = os.path.join(FEATURE_CACHE_DIR, name)
+        if name.endswith(".parquet") and name not in referenced:
+            try:
+                if now - os.path.getmtime(path) > ORPHAN_GRACE_SECONDS:
+                    _remove_file(path)
+            except OSError:
+                pass
+    return kept
+
+
+def _read_index():
+    # Called with _lock held
+    global _index, _index_mtime
+    mtime = _index_file_mtime()
+    if _index is not None and mtime == _index_mtime:
+        return _index
+    try:
+        with open(INDEX_FILE, "r") as f:
+            entries = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        entries = []
+    kept = _prune(entries, time.time())
+    if len(kept) != len(entries):
+        _write_index(kept)
+    else:
+        _index, _index_mtime = kept, mtime
+    return _index
+
+
+def _write_index(entries):
+    # Called with _lock held
+    global _index, _index_mtime
+    os.makedirs(FEATURE_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{INDEX_FILE}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(entries, f, indent=1)
+    os.replace(tmp_path, INDEX_FILE)
+    _index, _index_mtime = entries, _index_file_mtime()
+
+
+def _tags_key(tags):
+    return json.dumps(tags, sort_keys=True)
+
+
+def _contains(outer, inner):
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] >= inner[3]
+
+
+def _is_fresh(entry, now):
+    return now - entry["created"] < MAX_AGE_DAYS * 24 * 60 * 60
+
+
+def query_bbox(point, dist):
+    """
+    Returns the (west, south, east, north) box features_from_point uses.
+    """
+    return tuple(float(v) for v in ox.utils_geo.bbox_from_point(point, dist))
+
+
+def load_features(layer, tags, point, dist):
+    """
+    Returns the cached features for the request, None if the area is cached
+    as having no such features, or MISS.
+    """
+    if pyarrow is None:
+        return MISS
+
+    bbox = query_bbox(point, dist)
+    tags_key = _tags_key(tags)
+    now = time.time()
+    with _lock:
+        entries = _read_index()
+    for entry in entries:
+        if entry["layer"] != layer or entry["tags"] != tags_key:
+            continue
+        if not _is_fresh(entry, now) or not _contains(entry["bbox"], bbox):
+            continue
+        if entry["path"] is None:
+            return None
+        try:
+            gdf = gpd.read_parquet(entry["path"], bbox=bbox, memory_map=True)
+        except (OSError, ValueError):
+            continue
+        print(f"✓ Loaded {layer} from cache")
+        return gdf if not gdf.empty else None
+    return MISS
+
+
+def store_features(layer, tags, point, dist, gdf):
+    """
+    Caches a downloaded layer (None meaning "no features"). Cached areas of
+    the same layer that the new one covers are dropped.
+    """
+    if pyarrow is None:
+        return
+
+    bbox = query_bbox(point, dist)
+    path = None
+    if gdf is not None and not gdf.empty:
+        os.makedirs(FEATURE_CACHE_DIR, exist_ok=True)
+        path = os.path.join(FEATURE_CACHE_DIR, f"{layer}_{uuid.uuid4().hex}.parquet")
+        # Only geometry is drawn; OSM tag columns are ragged and not needed.
+        gdf[["geometry"]].reset_index(drop=True).to_parquet(path, write_covering_bbox=True)
+
+    tags_key = _tags_key(tags)
+    now = time.time()
+    with _lock:
+        kept = []
+        for entry in _read_index():
+            same_layer = entry["layer"] == layer and entry["tags"] == tags_key
+            if same_layer and (_contains(bbox, entry["bbox"]) or not _is_fresh(entry, now)):
+                if entry["path"]:
+                    _remove_file(entry["path"])
+                continue
+            kept.append(entry)
+        kept.append({"layer": layer, "tags": tags_key, "bbox": list(bbox), "path": path, "created": now})
+        _write_index(kept)
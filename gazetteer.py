@@ -0,0 +1,180 @@
+"""
+Optional offline gazetteer for instant place lookup and autocomplete.
+
+Build it once from a GeoNames dump (https://download.geonames.org/export/dump/,
+e.g. cities15000.txt, plus countryInfo.txt for country names):
+
+    python gazetteer.py cities15000.txt --countries countryInfo.txt
+
+This writes cache/gazetteer.tsv, one row per place name sorted by its
+normalized form (accents stripped, case folded), most populous first. At
+runtime the keys are held in one sorted list, so an exact or prefix lookup is
+a binary search plus a short scan. Without the file every lookup is a miss
+and callers fall back to Nominatim. The file's mtime is checked on every
+call, so a gazetteer built or rebuilt while the web UI runs is picked up.
+"""
+import argparse
+import bisect
+import heapq
+import os
+import threading
+import unicodedata
+
+GAZETTEER_FILE = os.path.join("cache", "gazetteer.tsv")
+# Prefix searches look at no more rows than this before ranking by population
+MAX_PREFIX_SCAN = 5000
+
+_index = None
+_lock = threading.Lock()
+
+
+def normalize(text):
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(stripped.casefold().split())
+
+
+def _file_mtime():
+    try:
+        return os.stat(GAZETTEER_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _load():
+    global _index
+    mtime = _file_mtime()
+    if _index is not None and _index[2] == mtime:
+        return _index
+    with _lock:
+        if _index is not None and _index[2] == mtime:
+            return _index
+        keys = []
+        places = []
+        try:
+            with open(GAZETTEER_FILE, "r", encoding="utf-8") as f:
+                for line in f:
+                    key, name, country, country_code, lat, lon, population = line.rstrip("\n").split("\t")
+                    keys.append(key)
+                    places.append(
+                        (name, country, normalize(country), country_code.casefold(), float(lat), float(lon), int(population))
+                    )
+        except FileNotFoundError:
+            pass
+        _index = (keys, places, mtime)
+        if keys:
+            print(f"✓ Loaded gazetteer with {len(keys):,} place names")
+        return _index
+
+
+def available():
+    return bool(_load()[0])
+
+
+def _matches_country(place, country):
+    return not country or country in (place[2], place[3])
+
+
+def _to_result(place):
+    name, country, _, country_code, lat, lon, _ = place
+    return {"name": name, "country": country, "country_code": country_code.upper(), "lat": lat, "lon": lon}
+
+
+def lookup(city, country=""):
+    """
+    Returns the most populous place named city (in country, matched by name
+    or ISO code, if given) as a dict, or None.
+    """
+    keys, places, _ = _load()
+    key = normalize(city)
+    country = normalize(country)
+    start = bisect.bisect_left(keys, key)
+    for index in range(start, bisect.bisect_right(keys, key, lo=start)):
+        # Rows with the same key are stored most populous first
+        if _matches_country(places[index], country):
+            return _to_result(places[index])
+    return None
+
+
+def suggest(prefix, country="", limit=8):
+    """
+    Returns up to limit places whose name starts with prefix, most populous
+    first.
+    """
+    keys, places, _ = _load()
+    prefix = normalize(prefix)
+    if not prefix:
+        return []
+    country = normalize(country)
+    start = bisect.bisect_left(keys, prefix)
+    end = min(bisect.bisect_left(keys, prefix + "\uffff", lo=start), start + MAX_PREFIX_SCAN)
+    candidates = (places[index] for index in range(start, end) if _matches_country(places[index], country))
+    seen = set()
+    results = []
+    for place in heapq.nlargest(limit * 2, candidates, key=lambda place: place[6]):
+        # The ASCII spelling of a name points at the same place
+        if (place[4], place[5]) in seen:
+            continue
+        seen.add((place[4], place[5]))
+        results.append(_to_result(place))
+        if len(results) == limit:
+            break
+    return results
+
+
+def _read_countries(path):
+    countries = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#") or not line.strip():
+                continue
+            fields = line.rstrip("\n").split("\t")
+            countries[fields[0]] = fields[4]
+    return countries
+
+
+def build(cities_path, countries_path=None, min_population=0, output_path=GAZETTEER_FILE):
+    """
+    Builds the gazetteer file from a GeoNames cities dump. Returns the
+    number of rows written.
+    """
+    countries = _read_countries(countries_path) if countries_path else {}
+    rows = []
+    with open(cities_path, "r", encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 15:
+                continue
+            name, ascii_name = fields[1], fields[2]
+            lat, lon, country_code = fields[4], fields[5], fields[8]
+            population = int(fields[14] or 0)
+            if population < min_population:
+                continue
+            country = countries.get(country_code, country_code)
+            for key in {normalize(name), normalize(ascii_name)} - {""}:
+                rows.append((key, -population, name, country, country_code, lat, lon))
+
+    rows.sort()
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for key, negative_population, name, country, country_code, lat, lon in rows:
+            f.write(f"{key}\t{name}\t{country}\t{country_code}\t{lat}\t{lon}\t{-negative_population}\n")
+    os.replace(tmp_path, output_path)
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline gazetteer from a GeoNames dump.")
+    parser.add_argument("cities", help="GeoNames cities file, e.g. cities15000.txt")
+    parser.add_argument("--countries", help="GeoNames countryInfo.txt, for country names")
+    parser.add_argument("--min-population", type=int, default=0, help="Skip smaller places")
+    parser.add_argument("--output", default=GAZETTEER_FILE, help=f"Output file (default: {GAZETTEER_FILE})")
+    args = parser.parse_args()
+
+    count = build(args.cities, args.countries, args.min_population, args.output)
+    print(f"✓ Wrote {count:,} place names to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 import os
 
 from create_map_poster import (
-    create_poster,
+    fetch_map_data,
     get_available_themes,
     get_coordinates,
     load_theme,
+    pack_map_data,
+    render_poster,
 )
 
 EXAMPLES_DIR = "examples"
@@ -22,18 +24,21 @@ def main():
 
     coords = get_coordinates(CITY, COUNTRY)
 
+    # Every theme draws the same area, so download it once.
+    map_data = pack_map_data(fetch_map_data(coords, DISTANCE, show_progress=False))
+
     for theme_name in themes:
         theme = load_theme(theme_name)
         filename = f"{FILENAME_PREFIX}_{theme_name}.png"
         output_file = os.path.join(EXAMPLES_DIR, filename)
-        create_poster(
+        render_poster(
             CITY,
             COUNTRY,
             coords,
             DISTANCE,
             output_file,
             theme,
-            show_progress=False,
+            map_data,
         )
         print(f"Saved {output_file}")
 
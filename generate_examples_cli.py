@@ -1,12 +1,17 @@
 import argparse
 import os
 import unicodedata
+from concurrent.futures import ProcessPoolExecutor
 
+import shared_geometry
 from create_map_poster import (
-    create_poster,
+    fetch_map_data,
     get_available_themes,
     get_coordinates,
     load_theme,
+    pack_map_data,
+    render_poster,
+    render_shared_poster,
 )
 
 
@@ -34,6 +39,12 @@ def main():
         default="",
         help="Filename prefix; defaults to <city>_<distance>m",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Render processes; themes are rendered in parallel (default: 1)",
+    )
     args = parser.parse_args()
 
     os.makedirs(args.output_dir, exist_ok=True)
@@ -44,20 +55,44 @@ def main():
     coords = get_coordinates(args.city, args.country)
     prefix = args.prefix or f"{slugify(args.city)}_{args.distance}m"
 
-    for theme_name in themes:
-        theme = load_theme(theme_name)
-        filename = f"{prefix}_{theme_name}.png"
-        output_file = os.path.join(args.output_dir, filename)
-        create_poster(
-            args.city,
-            args.country,
-            coords,
-            args.distance,
-            output_file,
-            theme,
-            show_progress=False,
-        )
-        print(f"Saved {output_file}")
+    # Every theme draws the same area, so download it once.
+    packed = pack_map_data(fetch_map_data(coords, args.distance, show_progress=False))
+    jobs = [
+        (load_theme(theme_name), os.path.join(args.output_dir, f"{prefix}_{theme_name}.png"))
+        for theme_name in themes
+    ]
+
+    if args.workers <= 1:
+        for theme, output_file in jobs:
+            render_poster(args.city, args.country, coords, args.distance, output_file, theme, packed)
+            print(f"Saved {output_file}")
+        return
+
+    # Workers map the geometry read-only instead of each receiving a pickled copy
+    geometry_path = shared_geometry.publish(packed)
+    try:
+        with ProcessPoolExecutor(max_workers=min(args.workers, len(jobs))) as pool:
+            futures = [
+                (
+                    pool.submit(
+                        render_shared_poster,
+                        geometry_path,
+                        args.city,
+                        args.country,
+                        coords,
+                        args.distance,
+                        output_file,
+                        theme,
+                    ),
+                    output_file,
+                )
+                for theme, output_file in jobs
+            ]
+            for future, output_file in futures:
+                future.result()
+                print(f"Saved {output_file}")
+    finally:
+        shared_geometry.release(geometry_path)
 
 
 if __name__ == "__main__":
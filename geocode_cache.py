@@ -0,0 +1,79 @@
+"""
+On-disk cache of geocoding results for poster jobs.
+
+get_coordinates answers from the offline gazetteer when it has one, then
+from this cache, and only then asks Nominatim, storing what it finds. Keys
+are the normalized city and country (see gazetteer.normalize), so lookups
+differing only in case or accents share an entry; answers of a Nominatim
+other than the public one (create_map_poster.NOMINATIM_URL, e.g. osm_stubs)
+are keyed by its URL too, so they never stand in for real ones. The cache
+is a small JSON file, loaded once and rewritten atomically on every store;
+places do not move, so entries are kept for MAX_AGE_DAYS.
+
+Because the cached coordinates are reused verbatim, every job for a place
+downloads exactly the same area, which is what lets the Overpass response
+cache and the feature cache answer it (see cache_warmer).
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+from gazetteer import normalize
+
+GEOCODE_CACHE_FILE = os.path.join("cache", "geocode.json")
+MAX_AGE_DAYS = 180
+
+_entries = None
+_counts = {"hits": 0, "misses": 0}
+_lock = threading.Lock()
+
+
+def _key(city, country):
+    # Imported here, since create_map_poster imports this module
+    from create_map_poster import NOMINATIM_URL, PUBLIC_NOMINATIM_URL
+
+    key = f"{normalize(city)}|{normalize(country)}"
+    return key if NOMINATIM_URL == PUBLIC_NOMINATIM_URL else f"{NOMINATIM_URL}|{key}"
+
+
+def _load():
+    global _entries
+    if _entries is None:
+        try:
+            with open(GEOCODE_CACHE_FILE, "r", encoding="utf-8") as f:
+                _entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            _entries = {}
+    return _entries
+
+
+def lookup(city, country):
+    """
+    Returns the cached {"lat", "lon", "address"} of a place, or None.
+    """
+    with _lock:
+        entry = _load().get(_key(city, country))
+        fresh = entry is not None and time.time() - entry["created"] < MAX_AGE_DAYS * 24 * 60 * 60
+        _counts["hits" if fresh else "misses"] += 1
+    return entry if fresh else None
+
+
+def store(city, country, lat, lon, address=""):
+    with _lock:
+        entries = _load()
+        entries[_key(city, country)] = {"lat": lat, "lon": lon, "address": address, "created": time.time()}
+        os.makedirs(os.path.dirname(GEOCODE_CACHE_FILE), exist_ok=True)
+        tmp_path = f"{GEOCODE_CACHE_FILE}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=1, ensure_ascii=False)
+        os.replace(tmp_path, GEOCODE_CACHE_FILE)
+
+
+def stats():
+    """
+    Returns the number of cached places and the hits and misses so far.
+    """
+    with _lock:
+        return {"entries": len(_load()), **_counts}
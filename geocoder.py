@@ -0,0 +1,136 @@
+"""
+Async Nominatim lookups for the web UI's location preview.
+
+Lookups share one pooled httpx.AsyncClient and never block a worker thread:
+the one-request-per-second limit of Nominatim's usage policy is an
+asyncio.sleep rather than time.sleep. Request slots are booked with
+create_map_poster.nominatim_delay, so these lookups and the poster jobs'
+get_coordinates calls keep to the limit together. Identical
+queries that are in flight at the same time are answered by a single
+request. A caller may pass a session id (one per browser tab); a newer
+query from the same session supersedes the older one, which then stops
+waiting and, if no one else needs its answer, is cancelled before it
+reaches Nominatim.
+"""
+import asyncio
+
+import httpx
+
+from create_map_poster import NOMINATIM_URL, nominatim_delay
+
+USER_AGENT = "city_map_poster_webui"
+TIMEOUT_SECONDS = 10
+
+
+class Superseded(Exception):
+    """
+    Raised when a newer query from the same session replaced this one.
+    """
+
+
+class _State:
+    # Everything asyncio-bound lives here, one instance per event loop
+    def __init__(self, loop):
+        self.loop = loop
+        self.client = None
+        self.lookups = {}
+        self.waiters = {}
+        self.sessions = {}
+
+
+_state = None
+
+
+def _get_state():
+    global _state
+    loop = asyncio.get_running_loop()
+    if _state is None or _state.loop is not loop:
+        _state = _State(loop)
+    return _state
+
+
+def _get_client(state):
+    if state.client is None:
+        state.client = httpx.AsyncClient(
+            headers={"User-Agent": USER_AGENT},
+            timeout=TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=2),
+        )
+    return state.client
+
+
+async def _lookup(state, query):
+    delay = nominatim_delay()
+    if delay > 0:
+        await asyncio.sleep(delay)
+    response = await _get_client(state).get(
+        NOMINATIM_URL, params={"q": query, "format": "jsonv2", "limit": 1}
+    )
+    response.raise_for_status()
+    results = response.json()
+    if not results:
+        raise ValueError("Location not found.")
+    try:
+        return {
+            "lat": float(results[0]["lat"]),
+            "lon": float(results[0]["lon"]),
+            "address": results[0].get("display_name", ""),
+        }
+    except (KeyError, TypeError, ValueError, AttributeError):
+        raise ValueError("The geocoding service sent an unexpected answer.") from None
+
+
+async def geocode(query, session=None):
+    """
+    Returns {"lat", "lon", "address"} for query. Raises ValueError if
+    nothing was found, Superseded if a newer query from the same session
+    arrived first, and httpx errors if Nominatim could not be reached.
+    """
+    state = _get_state()
+    key = " ".join(query.casefold().split())
+
+    superseded = asyncio.Event()
+    if session:
+        previous = state.sessions.get(session)
+        if previous:
+            previous.set()
+        state.sessions[session] = superseded
+
+    task = state.lookups.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_lookup(state, query))
+        state.lookups[key] = task
+        state.waiters[task] = 0
+
+        def forget(done):
+            if state.lookups.get(key) is done:
+                del state.lookups[key]
+
+        task.add_done_callback(forget)
+    state.waiters[task] += 1
+
+    stop = asyncio.ensure_future(superseded.wait())
+    try:
+        await asyncio.wait({task, stop}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stop.cancel()
+        state.waiters[task] -= 1
+        if not state.waiters[task]:
+            del state.waiters[task]
+            if not task.done():
+                # Nobody is waiting for this answer any more
+                task.cancel()
+                if state.lookups.get(key) is task:
+                    del state.lookups[key]
+        if session and state.sessions.get(session) is superseded:
+            del state.sessions[session]
+
+    if not task.done():
+        raise Superseded()
+    return task.result()
+
+
+async def aclose():
+    if _state is not None and _state.client is not None:
+        await _state.client.aclose()
+        _state.client = None
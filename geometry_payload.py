@@ -0,0 +1,113 @@
+"""
+Compact binary encoding of packed map geometry for the browser.
+
+encode takes the arrays of create_map_poster.pack_map_data and returns a
+gzip-compressed payload that the web UI draws on a canvas in any theme, so
+trying another theme needs no server round trip. Lines and rings are
+simplified to a fraction of a preview pixel, and coordinates are quantized
+to 16-bit integers across the poster frame (the map bounds plus the 2%
+padding render_poster adds).
+
+Layout, little-endian; the arrays after the header are aligned to their
+element size, so they can be viewed as typed arrays without copying:
+
+    magic        4 bytes   b"MPG1"
+    header       u32       road count, road vertex count,
+                           ring count, ring vertex count
+    frame        4 f64     west, south, east, north
+    point        2 f64     latitude, longitude of the poster centre
+    figsize      2 f64     poster width and height in inches
+    road_classes u8[roads]     index into ROAD_CLASS_ORDER
+    ring_layers  u8[rings]     0 water, 1 parks
+    (padding to 4 bytes)
+    road_counts  u32[roads]    vertices per road
+    ring_counts  u32[rings]    vertices per ring
+    road_xy      u16[2 * road vertices]   x, y pairs; y = 0 is south
+    ring_xy      u16[2 * ring vertices]
+"""
+import gzip
+import struct
+
+import numpy as np
+import shapely
+
+MAGIC = b"MPG1"
+QUANT_MAX = 65535
+# Simplification tolerance as a fraction of the frame width; 1/4096 is
+# about a pixel of a 4096 px wide preview.
+SIMPLIFY_FRACTION = 1 / 4096
+FRAME_PADDING = 0.02
+
+
+def _frame(bounds, padding=FRAME_PADDING):
+    west, south, east, north = bounds
+    pad_ew = (east - west) * padding
+    pad_ns = (north - south) * padding
+    return np.array([west - pad_ew, south - pad_ns, east + pad_ew, north + pad_ns])
+
+
+def _simplified(coords, offsets, tolerance, ring=False):
+    # Returns the simplified vertices and the index of each kept part
+    counts = np.diff(offsets)
+    if not len(counts):
+        return np.empty((0, 2)), np.empty(0, dtype=np.int64)
+    indices = np.repeat(np.arange(len(counts)), counts)
+    build = shapely.linearrings if ring else shapely.linestrings
+    parts = shapely.simplify(build(coords, indices=indices), tolerance, preserve_topology=ring)
+    simplified, index = shapely.get_coordinates(parts, return_index=True)
+    return simplified, index
+
+
+def _quantized(coords, index, frame, min_vertices):
+    # Quantizes and drops repeated vertices and parts that collapsed below
+    # min_vertices; returns the vertices, the kept parts and their counts
+    scale = QUANT_MAX / np.maximum(frame[2:] - frame[:2], 1e-12)
+    grid = np.clip(np.rint((coords - frame[:2]) * scale), 0, QUANT_MAX).astype(np.uint16)
+    keep = np.ones(len(grid), dtype=bool)
+    keep[1:] = (grid[1:] != grid[:-1]).any(axis=1) | (index[1:] != index[:-1])
+    grid, index = grid[keep], index[keep]
+    parts, counts = np.unique(index, return_counts=True)
+    valid = counts >= min_vertices
+    grid = grid[np.isin(index, parts[valid])]
+    return grid, parts[valid], counts[valid]
+
+
+def encode(packed, point, figsize):
+    """
+    Returns the gzip-compressed payload for pack_map_data arrays. point is
+    the poster's (lat, lon) and figsize its size in inches.
+    """
+    frame = _frame(packed["bounds"])
+    tolerance = (frame[2] - frame[0]) * SIMPLIFY_FRACTION
+
+    road_coords, road_index = _simplified(packed["road_coords"], packed["road_offsets"], tolerance)
+    road_xy, roads, road_counts = _quantized(road_coords, road_index, frame, 2)
+    ring_coords, ring_index = _simplified(packed["ring_coords"], packed["ring_offsets"], tolerance, ring=True)
+    ring_xy, rings, ring_counts = _quantized(ring_coords, ring_index, frame, 4)
+
+    road_classes = np.asarray(packed["road_classes"], dtype=np.uint8)[roads]
+    ring_layers = np.asarray(packed["ring_layers"], dtype=np.uint8)[rings]
+    codes = road_classes.tobytes() + ring_layers.tobytes()
+
+    header = MAGIC + struct.pack(
+        "<4I8d",
+        len(roads),
+        len(road_xy),
+        len(rings),
+        len(ring_xy),
+        *frame,
+        *point,
+        *figsize,
+    )
+    body = b"".join(
+        [
+            header,
+            codes,
+            b"\0" * (-len(codes) % 4),
+            road_counts.astype("<u4").tobytes(),
+            ring_counts.astype("<u4").tobytes(),
+            road_xy.astype("<u2").tobytes(),
+            ring_xy.astype("<u2").tobytes(),
+        ]
+    )
+    return gzip.compress(body, compresslevel=6)
@@ -0,0 +1,387 @@
+"""
+Load test for the web UI, run against local Nominatim/Overpass stand-ins.
+
+    python loadtest.py --concurrency 8 --duration 60
+
+Starts osm_stubs and a web UI server pointed at them (or uses --url to test a
+server that is already running), then has --concurrency virtual users
+request /, query /graphql and submit posters to /api/generate, polling
+/api/status until each job is done, for --duration seconds. Each user sends
+its own X-Client-Id, so fair sharing between clients is exercised too.
+/api/stats is sampled once a second for queue depth and memory.
+
+The report lists throughput and latency percentiles per endpoint, end-to-end
+job times, queue depth and server memory. --json saves it, and --baseline
+compares a run against a saved report and exits with status 1 if job
+throughput or p95 latency got worse by more than --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+import osm_stubs
+
+SCENARIOS = ("generate", "index", "graphql")
+DEFAULT_MIX = "generate=1,index=3,graphql=3"
+GRAPHQL_QUERY = "{ themes posters { filename } storage { posters { files bytes } } }"
+STATUS_POLL_SECONDS = 0.5
+STATS_POLL_SECONDS = 1.0
+SERVER_START_TIMEOUT = 60
+# Read-only files the started server uses from the repository; everything
+# it writes (posters/, trashcan/, cache/) stays in its own working directory
+SERVER_RESOURCES = ("themes", "fonts", "templates", "static", "examples")
+
+
+def _percentile(samples, percent):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def _summary(samples, elapsed):
+    return {
+        "count": len(samples),
+        "per_second": round(len(samples) / elapsed, 2) if elapsed else 0,
+        "p50_ms": _ms(_percentile(samples, 50)),
+        "p95_ms": _ms(_percentile(samples, 95)),
+        "p99_ms": _ms(_percentile(samples, 99)),
+        "max_ms": _ms(max(samples) if samples else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def _json(response):
+    # The JSON body of a successful response, or None
+    if response is None or response.status_code >= 400:
+        return None
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{name}' (choose from {', '.join(SCENARIOS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class LoadTest:
+    def __init__(self, base_url, args):
+        self.base_url = base_url
+        self.args = args
+        self.latencies = {}
+        self.errors = {}
+        self.jobs = {"done": [], "error": [], "timeout": 0}
+        self.posters = []
+        self.samples = []
+
+    def _record(self, endpoint, seconds, ok):
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    async def _request(self, client, endpoint, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+        except httpx.HTTPError:
+            self._record(endpoint, time.perf_counter() - start, False)
+            return None
+        self._record(endpoint, time.perf_counter() - start, response.status_code < 400)
+        return response
+
+    async def index(self, client, user):
+        await self._request(client, "GET /", "GET", "/")
+
+    async def graphql(self, client, user):
+        await self._request(client, "POST /graphql", "POST", "/graphql", json={"query": GRAPHQL_QUERY})
+
+    async def generate(self, client, user):
+        place = random.randrange(self.args.places)
+        data = {
+            "city": f"Stub City {place}",
+            "country": "Nowhere",
+            "theme": self.args.theme,
+            "distance": str(self.args.distance),
+            "output_format": self.args.format,
+        }
+        start = time.perf_counter()
+        response = await self._request(client, "POST /api/generate", "POST", "/api/generate", data=data)
+        job = _json(response)
+        if not job or "job_id" not in job:
+            self.jobs["error"].append(time.perf_counter() - start)
+            return
+        job_id = job["job_id"]
+        while time.perf_counter() - start < self.args.job_timeout:
+            await asyncio.sleep(STATUS_POLL_SECONDS)
+            response = await self._request(client, "GET /api/status", "GET", f"/api/status/{job_id}")
+            job = _json(response)
+            if job is None:
+                continue
+            if job.get("status") in ("done", "error"):
+                self.jobs[job["status"]].append(time.perf_counter() - start)
+                if job.get("filename"):
+                    self.posters.append(job["filename"])
+                return
+        self.jobs["timeout"] += 1
+
+    async def _user(self, user, mix, deadline):
+        headers = {"X-Client-Id": f"loadtest-{user}"}
+        async with httpx.AsyncClient(base_url=self.base_url, headers=headers, timeout=self.args.job_timeout) as client:
+            names, weights = list(mix), list(mix.values())
+            while time.monotonic() < deadline:
+                await getattr(self, random.choices(names, weights)[0])(client, user)
+
+    async def _monitor(self, stop):
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=10) as client:
+            while not stop.is_set():
+                try:
+                    stats = (await client.get("/api/stats")).json()
+                except (httpx.HTTPError, ValueError):
+                    stats = None
+                if stats:
+                    admission = stats["admission"]
+                    self.samples.append(
+                        {
+                            "queued": stats["jobs"].get("queued", 0),
+                            "running": stats["jobs"].get("running", 0),
+                            "admission_waiting": sum(admission["waiting"].values()),
+                            "reserved_mb": admission["in_use_bytes"] / 2**20,
+                            "rss_mb": (stats["memory"]["rss_bytes"] or 0) / 2**20,
+                            "peak_rss_mb": stats["memory"]["peak_rss_bytes"] / 2**20,
+                        }
+                    )
+                try:
+                    await asyncio.wait_for(stop.wait(), STATS_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _cleanup(self):
+        # Move the test posters to the trash and purge them from there, by
+        # the name they got in the trash: a clash with a poster already
+        # trashed gets the new one renamed
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=60) as client:
+            trashed = []
+            for filename in self.posters:
+                result = _json(await client.post("/api/posters/delete", data={"filename": filename}))
+                if result and result.get("status") == "ok":
+                    trashed.append(result["filename"])
+            if trashed:
+                await client.post("/api/posters/purge-bulk", data={"filenames": trashed})
+
+    async def run(self):
+        mix = _parse_mix(self.args.mix)
+        stop = asyncio.Event()
+        monitor = asyncio.create_task(self._monitor(stop))
+        start = time.monotonic()
+        deadline = start + self.args.duration
+        await asyncio.gather(*(self._user(user, mix, deadline) for user in range(self.args.concurrency)))
+        elapsed = time.monotonic() - start
+        stop.set()
+        await monitor
+        if self.args.url and not self.args.keep_posters:
+            await self._cleanup()
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        def peak(key):
+            return round(max((sample[key] for sample in self.samples), default=0), 1)
+
+        return {
+            "concurrency": self.args.concurrency,
+            "seconds": round(elapsed, 1),
+            "endpoints": {
+                endpoint: {**_summary(samples, elapsed), "errors": self.errors.get(endpoint, 0)}
+                for endpoint, samples in sorted(self.latencies.items())
+            },
+            "jobs": {
+                **_summary(self.jobs["done"], elapsed),
+                "per_minute": round(len(self.jobs["done"]) / elapsed * 60, 2) if elapsed else 0,
+                "failed": len(self.jobs["error"]),
+                "timed_out": self.jobs["timeout"],
+            },
+            "server": {
+                "max_queued": peak("queued"),
+                "max_running": peak("running"),
+                "max_admission_waiting": peak("admission_waiting"),
+                "max_reserved_mb": peak("reserved_mb"),
+                "max_rss_mb": peak("rss_mb"),
+                "peak_rss_mb": peak("peak_rss_mb"),
+            },
+        }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(stubs, extra_env, workdir):
+    """
+    Starts a web UI server in workdir, so its posters, request history and
+    caches of stub answers never mix with the real ones.
+    """
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in SERVER_RESOURCES:
+        os.symlink(os.path.join(app_dir, name), os.path.join(workdir, name))
+    port = _free_port()
+    env = {
+        **os.environ,
+        **extra_env,
+        "NOMINATIM_URL": f"{stubs.url}/search",
+        "OVERPASS_URL": f"{stubs.url}/api",
+    }
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "webui:app", "--app-dir", app_dir,
+            "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+        ],
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The web UI server exited during startup")
+        try:
+            if httpx.get(f"{base_url}/api/stats", timeout=2).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("The web UI server did not start in time")
+
+
+def print_report(report):
+    print(f"\n{report['concurrency']} users for {report['seconds']}s")
+    print(f"{'endpoint':<22}{'count':>8}{'req/s':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    rows = list(report["endpoints"].items()) + [("jobs (end to end)", {**report["jobs"], "errors": report["jobs"]["failed"]})]
+    for name, row in rows:
+        print(
+            f"{name:<22}{row['count']:>8}{row['per_second']:>8}"
+            f"{row['p50_ms'] or '-':>10}{row['p95_ms'] or '-':>10}{row['p99_ms'] or '-':>10}{row['errors']:>8}"
+        )
+    print(f"Jobs: {report['jobs']['per_minute']}/min, {report['jobs']['timed_out']} timed out")
+    server = report["server"]
+    print(
+        f"Queue: up to {server['max_queued']:g} queued, {server['max_running']:g} running, "
+        f"{server['max_admission_waiting']:g} waiting for admission"
+    )
+    print(
+        f"Memory: up to {server['max_reserved_mb']:,.0f} MB reserved, {server['max_rss_mb']:,.0f} MB resident "
+        f"(peak {server['peak_rss_mb']:,.0f} MB)"
+    )
+
+
+def compare(report, baseline, tolerance):
+    """
+    Prints how report differs from baseline and returns the regressions:
+    job throughput or p95 latency (jobs and every endpoint) worse by more
+    than tolerance (a fraction).
+    """
+    regressions = []
+
+    def check(name, current, previous, higher_is_better=False):
+        if not current or not previous:
+            return
+        change = (current - previous) / previous
+        print(f"  {name}: {previous} -> {current} ({change:+.0%})")
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(name)
+
+    print("\nCompared with baseline:")
+    check("jobs per minute", report["jobs"]["per_minute"], baseline["jobs"]["per_minute"], higher_is_better=True)
+    check("job p95 ms", report["jobs"]["p95_ms"], baseline["jobs"]["p95_ms"])
+    for endpoint, row in report["endpoints"].items():
+        if endpoint in baseline["endpoints"]:
+            check(f"{endpoint} p95 ms", row["p95_ms"], baseline["endpoints"][endpoint]["p95_ms"])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the web UI against local OSM stand-ins.")
+    parser.add_argument("--url", help="Test this running server instead of starting one (point it at osm_stubs yourself)")
+    parser.add_argument("--concurrency", "-c", type=int, default=4, help="Virtual users (default: 4)")
+    parser.add_argument("--duration", "-d", type=float, default=30, help="Seconds to keep starting requests (default: 30)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Scenario weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--places", type=int, default=20, help="Distinct places to generate posters of (default: 20)")
+    parser.add_argument("--distance", type=int, default=2000, help="Poster radius in meters (default: 2000)")
+    parser.add_argument("--theme", default="feature_based", help="Poster theme (default: feature_based)")
+    parser.add_argument("--format", default="png", help="Poster format (default: png)")
+    parser.add_argument("--job-timeout", type=float, default=300, help="Give up on a job after this many seconds")
+    parser.add_argument("--stub-latency-ms", type=float, default=0, help="Delay added to every stub response")
+    parser.add_argument("--server-env", action="append", default=[], metavar="NAME=VALUE", help="Extra environment for the started server, e.g. RENDER_WORKERS=4")
+    parser.add_argument("--keep-posters", action="store_true", help="Keep the generated posters (and the started server's directory)")
+    parser.add_argument("--json", help="Save the report to this file")
+    parser.add_argument("--baseline", help="Compare with a report saved by --json")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression against the baseline (default: 0.2)")
+    args = parser.parse_args()
+
+    try:
+        _parse_mix(args.mix)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    stubs = None
+    process = None
+    workdir = None
+    base_url = args.url
+    try:
+        if not base_url:
+            stubs = osm_stubs.start(latency=args.stub_latency_ms / 1000)
+            extra_env = dict(item.split("=", 1) for item in args.server_env)
+            workdir = tempfile.mkdtemp(prefix="loadtest-")
+            process, base_url = _start_server(stubs, extra_env, workdir)
+            print(f"✓ Web UI on {base_url}, stubs on {stubs.url}")
+        report = asyncio.run(LoadTest(base_url, args).run())
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        if stubs:
+            stubs.shutdown()
+        if workdir and args.keep_posters:
+            print(f"✓ Posters kept in {os.path.join(workdir, 'posters')}")
+        elif workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if stubs:
+        report["stubs"] = dict(stubs.stats)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✓ Report saved to {args.json}")
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"⚠ Regressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+Local stand-ins for the Nominatim and Overpass APIs.
+
+One HTTP server answers both services: Nominatim at /search and Overpass at
+/api/interpreter and /api/status. Point the web UI or the CLI at it with
+
+    NOMINATIM_URL=http://127.0.0.1:8901/search
+    OVERPASS_URL=http://127.0.0.1:8901/api
+
+Responses are replayed from cache/recordings/, keyed by a hash of the
+request. In record mode every request is forwarded to the public service,
+no faster than its usage policy allows (UPSTREAM_INTERVALS), and its
+response saved, so a few real runs build a realistic set of recordings;
+Nominatim searches that found nothing are not saved. A request without a
+recording gets a synthetic answer: a made-up location for any place name,
+and a street grid (or blocks of water and parks) inside the requested
+polygon, dense enough to render like a city. Run standalone with
+
+    python osm_stubs.py [--record] [--port 8901]
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import httpx
+
+RECORDINGS_DIR = os.path.join("cache", "recordings")
+UPSTREAMS = {
+    "nominatim": "https://nominatim.openstreetmap.org",
+    "overpass": "https://overpass-api.de",
+}
+USER_AGENT = "city_map_poster_stubs"
+# Seconds between forwarded requests per upstream; Nominatim's usage policy
+# allows one request a second, and Overpass is asked just as gently
+UPSTREAM_INTERVALS = {"nominatim": 1.0, "overpass": 1.0}
+# Synthetic street grid spacing and the blocks per way along a street
+GRID_DEGREES = 0.002
+BLOCKS_PER_WAY = 16
+# Synthetic water/park patches: one candidate per cell of this many blocks
+FEATURE_CELL_BLOCKS = 20
+# Street class by row/column index: the first divisor that matches wins
+GRID_CLASSES = (
+    (40, "motorway"),
+    (20, "primary"),
+    (10, "secondary"),
+    (5, "tertiary"),
+    (2, "residential"),
+    (1, "service"),
+)
+OVERPASS_STATUS = (
+    "Connected as: 0\n"
+    "Current time: {now}\n"
+    "Announced endpoint: none\n"
+    "Rate limit: 0\n"
+    "2 slots available now.\n"
+    "Currently running queries (pid, space limit, time limit, start time):\n"
+)
+
+
+def _service(path):
+    if path.startswith("/api/"):
+        return "overpass"
+    return "nominatim"
+
+
+def recording_key(method, path, query, body):
+    """
+    Returns the file name of the recording for a request. Query parameters
+    are sorted so their order does not matter.
+    """
+    canonical = json.dumps([method, path, sorted(parse_qsl(query)), body.decode("utf-8", "replace")])
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def _unit_hash(*parts):
+    # A stable pseudo-random number in [0, 1) for the given parts
+    digest = hashlib.sha1(repr(parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+
+def synthetic_place(query):
+    """
+    Returns a Nominatim search result list with a made-up but stable
+    location for query.
+    """
+    lat = -50 + 110 * _unit_hash("lat", query.casefold())
+    lon = -120 + 260 * _unit_hash("lon", query.casefold())
+    return [
+        {
+            "place_id": int(_unit_hash("id", query) * 10**9),
+            "lat": f"{lat:.7f}",
+            "lon": f"{lon:.7f}",
+            "display_name": query,
+            "boundingbox": [f"{lat - 0.1:.7f}", f"{lat + 0.1:.7f}", f"{lon - 0.1:.7f}", f"{lon + 0.1:.7f}"],
+        }
+    ]
+
+
+def _grid_class(index):
+    for divisor, highway in GRID_CLASSES:
+        if index % divisor == 0:
+            return highway
+
+
+def _node_id(i, j):
+    return (i + 2_000_000) * 4_000_000 + (j + 2_000_000)
+
+
+def _street_grid(bounds, highways):
+    # Ways cover whole tiles of BLOCKS_PER_WAY blocks aligned to a global
+    # grid, so split queries of one area agree on ids and node lists.
+    south, west, north, east = bounds
+    i0, i1 = int(south // GRID_DEGREES), int(north // GRID_DEGREES) + 1
+    j0, j1 = int(west // GRID_DEGREES), int(east // GRID_DEGREES) + 1
+    nodes = {}
+    ways = []
+    for orientation, (lines, span) in enumerate((((i0, i1), (j0, j1)), ((j0, j1), (i0, i1)))):
+        for line in range(*lines):
+            highway = _grid_class(line)
+            if highways is not None and highway not in highways:
+                continue
+            for tile in range(span[0] // BLOCKS_PER_WAY, span[1] // BLOCKS_PER_WAY + 1):
+                steps = range(tile * BLOCKS_PER_WAY, (tile + 1) * BLOCKS_PER_WAY + 1)
+                cells = [(line, step) if orientation == 0 else (step, line) for step in steps]
+                refs = []
+                for i, j in cells:
+                    node_id = _node_id(i, j)
+                    nodes[node_id] = (i * GRID_DEGREES, j * GRID_DEGREES)
+                    refs.append(node_id)
+                ways.append(
+                    {
+                        "type": "way",
+                        "id": 10**14 * orientation + _node_id(line, tile),
+                        "nodes": refs,
+                        "tags": {"highway": highway, "name": f"Synthetic {highway} {line}"},
+                    }
+                )
+    return nodes, ways
+
+
+def _feature_blocks(bounds, key, value):
+    south, west, north, east = bounds
+    cell = FEATURE_CELL_BLOCKS * GRID_DEGREES
+    # Ids per tag above the street grid's, so patches never share its nodes
+    offset = 10**15 * (1 + int(_unit_hash(key, value) * 1000))
+    nodes = {}
+    ways = []
+    for ci in range(int(south // cell), int(north // cell) + 1):
+        for cj in range(int(west // cell), int(east // cell) + 1):
+            if _unit_hash(key, value, ci, cj) >= 0.2:
+                continue
+            size = 2 + int(_unit_hash("size", key, ci, cj) * (FEATURE_CELL_BLOCKS - 4))
+            i, j = ci * FEATURE_CELL_BLOCKS + 1, cj * FEATURE_CELL_BLOCKS + 1
+            corners = [(i, j), (i, j + size), (i + size, j + size), (i + size, j)]
+            refs = []
+            for ni, nj in corners:
+                node_id = offset + _node_id(ni, nj)
+                nodes[node_id] = (ni * GRID_DEGREES + GRID_DEGREES / 3, nj * GRID_DEGREES + GRID_DEGREES / 3)
+                refs.append(node_id)
+            ways.append(
+                {
+                    "type": "way",
+                    "id": offset + _node_id(ci, cj),
+                    "nodes": refs + refs[:1],
+                    "tags": {key: value},
+                }
+            )
+    return nodes, ways
+
+
+def synthetic_overpass(query):
+    """
+    Returns an Overpass JSON response for an osmnx query: a street grid for
+    network queries, blocks of the requested tag for feature queries.
+    """
+    coords = [float(value) for value in re.findall(r"-?\d+\.?\d*", " ".join(re.findall(r"poly:'([^']*)'", query)))]
+    if not coords:
+        return {"elements": []}
+    lats, lons = coords[0::2], coords[1::2]
+    bounds = (min(lats), min(lons), max(lats), max(lons))
+
+    if '"highway"' in query:
+        allowed = re.search(r'\["highway"~"([^"]*)"\]', query)
+        highways = set(re.findall(r"[a-z_]+", allowed.group(1))) if allowed else None
+        nodes, ways = _street_grid(bounds, highways)
+    else:
+        nodes, ways = {}, []
+        for key, value in re.findall(r"\['([^']+)'='([^']+)'\]", query):
+            tag_nodes, tag_ways = _feature_blocks(bounds, key, value)
+            nodes.update(tag_nodes)
+            ways.extend(tag_ways)
+
+    elements = [{"type": "node", "id": node_id, "lat": lat, "lon": lon} for node_id, (lat, lon) in nodes.items()]
+    return {"version": 0.6, "generator": "osm_stubs", "elements": elements + ways}
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    The stand-in server. record=True forwards every request to the public
+    service and saves the response; latency adds a delay to each answer.
+    Counts of replayed, recorded and synthetic answers are kept in stats.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, record=False, latency=0.0, recordings_dir=RECORDINGS_DIR):
+        super().__init__(address, _StubHandler)
+        self.record = record
+        self.latency = latency
+        self.recordings_dir = recordings_dir
+        self.stats = {"replayed": 0, "recorded": 0, "synthetic": 0}
+        self._stats_lock = threading.Lock()
+        self._client = httpx.Client(headers={"User-Agent": USER_AGENT}, timeout=300) if record else None
+        self._upstream_locks = {service: threading.Lock() for service in UPSTREAMS}
+        self._upstream_last = {service: 0.0 for service in UPSTREAMS}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, kind):
+        with self._stats_lock:
+            self.stats[kind] += 1
+
+    def forward(self, service, method, path, query, body, headers):
+        """
+        Sends a request to the public service, one at a time per service and
+        at least UPSTREAM_INTERVALS[service] seconds apart.
+        """
+        url = f"{UPSTREAMS[service]}{path}" + (f"?{query}" if query else "")
+        with self._upstream_locks[service]:
+            delay = self._upstream_last[service] + UPSTREAM_INTERVALS[service] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                response = self._client.request(method, url, content=body or None, headers=headers)
+            finally:
+                self._upstream_last[service] = time.monotonic()
+        return response.status_code, response.headers.get("content-type", "application/json"), response.content
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _synthetic(self, path, query, body):
+        if path == "/api/status":
+            now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            return 200, "text/plain", OVERPASS_STATUS.format(now=now).encode()
+        if path == "/api/interpreter":
+            form = dict(parse_qsl(body.decode("utf-8"))) or dict(parse_qsl(query))
+            return 200, "application/json", json.dumps(synthetic_overpass(form.get("data", ""))).encode()
+        if path == "/search":
+            params = dict(parse_qsl(query))
+            return 200, "application/json", json.dumps(synthetic_place(params.get("q", ""))).encode()
+        return 404, "application/json", b'{"error": "unknown endpoint"}'
+
+    def _handle(self, method):
+        server = self.server
+        url = urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        service = _service(url.path)
+        key = recording_key(method, url.path, url.query, body)
+        path = os.path.join(server.recordings_dir, service, f"{key}.json")
+
+        if server.latency:
+            time.sleep(server.latency)
+        if server.record:
+            headers = {"Content-Type": self.headers.get("Content-Type", "")} if body else {}
+            status, content_type, content = server.forward(service, method, url.path, url.query, body, headers)
+            # The status is live by nature, and an empty search result would
+            # be replayed even after the place was added to OSM
+            if status == 200 and url.path != "/api/status" and content.strip() != b"[]":
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump({"content_type": content_type, "body": content.decode("utf-8")}, f)
+            server.count("recorded")
+            return self._respond(status, content_type, content)
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                recording = json.load(f)
+        except FileNotFoundError:
+            server.count("synthetic")
+            return self._respond(*self._synthetic(url.path, url.query, body))
+        server.count("replayed")
+        self._respond(200, recording["content_type"], recording["body"].encode("utf-8"))
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+def start(port=0, record=False, latency=0.0):
+    """
+    Starts a StubServer on 127.0.0.1 in a background thread and returns it;
+    port=0 picks a free port. Call shutdown() to stop it.
+    """
+    server = StubServer(("127.0.0.1", port), record=record, latency=latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve local stand-ins for Nominatim and Overpass.")
+    parser.add_argument("--port", type=int, default=8901, help="Port to listen on (default: 8901)")
+    parser.add_argument("--record", action="store_true", help="Forward requests to the public services and save the responses")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay added to every response")
+    args = parser.parse_args()
+
+    server = StubServer(("127.0.0.1", args.port), record=args.record, latency=args.latency_ms / 1000)
+    print(f"✓ Stubs listening on {server.url}")
+    print(f"  NOMINATIM_URL={server.url}/search")
+    print(f"  OVERPASS_URL={server.url}/api")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"✓ Served {server.stats}")
+
+
+if __name__ == "__main__":
+    main()
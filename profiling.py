@@ -0,0 +1,133 @@
+"""
+On-demand profiling of a single poster run.
+
+profile_run wraps one job and, when it ends, writes three files next to the
+poster, named after it:
+
+    <poster>.pstats       cProfile statistics; open with `python -m pstats`
+                          or snakeviz. Includes calls into C extensions
+                          (Agg, GEOS, pyogrio) as builtin entries.
+    <poster>.folded       Sampled call stacks in collapsed format, one
+                          "frame;frame;frame count" line per stack, ready for
+                          flamegraph.pl or speedscope.
+    <poster>.tracemalloc  tracemalloc snapshot of the memory still allocated
+                          at the end of the run; load with
+                          tracemalloc.Snapshot.load().
+
+cProfile and the stack sampler only follow the thread that entered
+profile_run. tracemalloc is process-wide, so allocations of other jobs
+running at the same time show up in the snapshot too. Only one run is
+profiled at a time; a second profiled job waits for the first, or with
+blocking=False runs unprofiled.
+"""
+import cProfile
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+from storage import MB
+
+SAMPLE_INTERVAL_SECONDS = 0.005
+# Frames kept per allocation traceback
+TRACEMALLOC_FRAMES = 16
+PROFILE_SUFFIXES = {
+    "pstats": ".pstats",
+    "collapsed": ".folded",
+    "allocations": ".tracemalloc",
+}
+
+_profile_lock = threading.Lock()
+
+
+def profile_paths(output_file):
+    """
+    Returns the profile files written for output_file, by kind.
+    """
+    base, _ = os.path.splitext(output_file)
+    return {kind: base + suffix for kind, suffix in PROFILE_SUFFIXES.items()}
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _StackSampler(threading.Thread):
+    # Polls one thread's current stack; time spent in C code is counted
+    # against the Python frame that called it
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+@contextmanager
+def profile_run(output_file, interval=SAMPLE_INTERVAL_SECONDS, blocking=True):
+    """
+    Profiles the with block and writes the profile files for output_file
+    (see profile_paths) when it exits, also if it raised. Yields a dict that
+    is filled with the written paths, the wall time and the peak traced
+    memory once the block is done.
+
+    With blocking=False the block is not kept waiting while another run is
+    profiled: it runs unprofiled and the dict only gets a "skipped" reason.
+    """
+    result = {}
+    if not _profile_lock.acquire(blocking=blocking):
+        result["skipped"] = "another profiled run was in progress"
+        yield result
+        return
+    try:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+        sampler = _StackSampler(threading.get_ident(), interval)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        sampler.start()
+        profiler.enable()
+        try:
+            yield result
+        finally:
+            profiler.disable()
+            sampler.stop()
+            elapsed = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+
+            paths = profile_paths(output_file)
+            os.makedirs(os.path.dirname(paths["pstats"]) or ".", exist_ok=True)
+            profiler.dump_stats(paths["pstats"])
+            with open(paths["collapsed"], "w") as f:
+                for stack, count in sampler.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            snapshot.dump(paths["allocations"])
+
+            result.update(paths)
+            result["seconds"] = round(elapsed, 3)
+            result["peak_traced_mb"] = round(peak / MB, 1)
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,386 @@
+"""
+Cost model and memory-based admission control for render jobs.
+
+estimate_job predicts how many street edges and water/park polygons a poster
+will download, and how much memory fetching and drawing it will take, before
+anything is fetched. Counts come from densities observed in earlier fetches
+of the same area, stored per grid cell in cache/density.json, and fall back
+to metro-wide averages for areas never fetched before. Such a first-time
+estimate is only a guess, so AdmissionController.admissible_bytes caps it at
+the budget rather than rejecting a place it has never measured.
+
+AdmissionController holds a memory budget and a number of render slots. A job
+reserves its estimated bytes and a slot before it starts; jobs that do not fit
+yet wait, in priority order, and jobs that could never fit are rejected.
+"""
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from create_map_poster import OUTPUT_DPI, OUTPUT_FIGSIZE, VECTOR_FORMATS, detail_dpi, get_lod_level
+from storage import MB
+
+DENSITY_FILE = os.path.join("cache", "density.json")
+DENSITY_CELL_DEGREES = 0.1
+
+# Used until an area has been fetched once: directed edges of the full
+# (network_type='all') graph and water/park polygons per km², averaged over a
+# metro area (a dense core reaches 1500 edges per km², its outskirts a tenth).
+DEFAULT_EDGES_PER_KM2 = 600
+DEFAULT_POLYGONS_PER_KM2 = 15
+# Share of the full network's edges kept at each LOD_LEVELS entry
+LOD_EDGE_FRACTIONS = (1.0, 0.45, 0.2, 0.04)
+
+# Graph, geometries and GeoDataFrames held while fetching, measured at the
+# peak of fetch_map_data
+BYTES_PER_EDGE = 3 * 1024
+BYTES_PER_POLYGON = 8 * 1024
+# Artists and path buffers while drawing
+BYTES_PER_DRAWN_EDGE = 512
+# Agg canvas, raw copy and RGB conversion of a raster poster
+BYTES_PER_PIXEL = 12
+# Split rendering: the shared band buffer and the figure image's copy of it
+BYTES_PER_SPLIT_PIXEL = 8
+JOB_OVERHEAD_BYTES = 64 * MB
+
+# Highest priority first
+PRIORITY_CLASSES = ("interactive", "batch", "print")
+# Recent admission waits kept per class for the latency report
+WAIT_SAMPLES = 500
+
+_densities = None
+_densities_lock = threading.Lock()
+
+
+CGROUP_MEMORY_LIMIT_FILES = (
+    "/sys/fs/cgroup/memory.max",
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+)
+
+
+def physical_memory_bytes():
+    """
+    Returns the memory this process may use: the machine's physical memory,
+    or the cgroup (v2 or v1) memory limit of its container if lower.
+    """
+    try:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, OSError, ValueError):
+        total = 4096 * MB
+    for path in CGROUP_MEMORY_LIMIT_FILES:
+        try:
+            with open(path, "r") as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        # "max" (v2) or a huge number (v1) means no limit
+        if limit.isdigit():
+            total = min(total, int(limit))
+    return total
+
+
+def process_memory_bytes():
+    """
+    Returns the resident memory of this process and its peak so far, in
+    bytes. The current figure is None where /proc is not available.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    if sys.platform != "darwin":
+        peak *= 1024
+    try:
+        with open("/proc/self/statm", "r") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        current = None
+    return current, peak
+
+
+def _cell_key(point):
+    lat, lon = point
+    return f"{int(lat // DENSITY_CELL_DEGREES)},{int(lon // DENSITY_CELL_DEGREES)}"
+
+
+def _load_densities():
+    global _densities
+    if _densities is None:
+        try:
+            with open(DENSITY_FILE, "r") as f:
+                _densities = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            _densities = {}
+    return _densities
+
+
+def _percentile(samples, percent):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))], 3)
+
+
+def _area_km2(dist):
+    return (2 * dist / 1000) ** 2
+
+
+def estimate_job(point, dist, output_format="png", dpi=OUTPUT_DPI, outputs=None, bands=0, band_workers=0):
+    """
+    Predicts the size of a poster job. Returns a dict with the expected
+    edge and polygon counts, the bytes held while fetching (fetch_bytes) and
+    drawing (render_bytes), and their sum (peak_bytes), since the fetched
+    data stays in memory while the poster is drawn.
+    outputs, a list of output specs (see parse_output_spec), replaces
+    output_format and dpi for a job that saves several variants; they are
+    saved one at a time, so only the largest raster counts.
+    bands and band_workers describe split rendering (see render_poster):
+    rasters are then drawn in that many bands on that many processes, whose
+    canvases and shared buffer count too, and the job occupies a render slot
+    per process (slots).
+    """
+    if outputs:
+        dpi = detail_dpi(outputs)
+    with _densities_lock:
+        density = _load_densities().get(_cell_key(point), {})
+    area_km2 = _area_km2(dist)
+    level = get_lod_level(dist, dpi)
+    edges = int(area_km2 * density.get("edges_per_km2", DEFAULT_EDGES_PER_KM2) * LOD_EDGE_FRACTIONS[level])
+    polygons = int(area_km2 * density.get("polygons_per_km2", DEFAULT_POLYGONS_PER_KM2))
+
+    fetch_bytes = JOB_OVERHEAD_BYTES + edges * BYTES_PER_EDGE + polygons * BYTES_PER_POLYGON
+    render_bytes = edges * BYTES_PER_DRAWN_EDGE
+    rasters = [spec for spec in outputs or [{"figsize": OUTPUT_FIGSIZE, "dpi": OUTPUT_DPI, "format": output_format}]
+               if spec["format"] not in VECTOR_FORMATS]
+    slots = 1
+    if rasters:
+        pixels = max(spec["figsize"][0] * spec["figsize"][1] * spec["dpi"] ** 2 for spec in rasters)
+        render_bytes += int(pixels) * BYTES_PER_PIXEL
+        if bands > 1 and band_workers:
+            slots = min(bands, band_workers)
+            render_bytes += int(pixels * (BYTES_PER_SPLIT_PIXEL + BYTES_PER_PIXEL * slots / bands))
+    return {
+        "edges": edges,
+        "polygons": polygons,
+        "fetch_bytes": fetch_bytes,
+        "render_bytes": render_bytes,
+        "peak_bytes": fetch_bytes + render_bytes,
+        "known_area": bool(density),
+        "slots": slots,
+    }
+
+
+def record_map_data(point, dist, map_data, dpi=OUTPUT_DPI):
+    """
+    Updates the density statistics of the area around point from a fetched
+    (G, water, parks) tuple. Densities are stored as full-network figures so
+    one entry serves every level of detail.
+    """
+    G, water, parks = map_data
+    area_km2 = _area_km2(dist)
+    edges_per_km2 = G.number_of_edges() / area_km2 / LOD_EDGE_FRACTIONS[get_lod_level(dist, dpi)]
+    polygons = sum(len(layer) for layer in (water, parks) if layer is not None)
+    polygons_per_km2 = polygons / area_km2
+
+    with _densities_lock:
+        densities = _load_densities()
+        key = _cell_key(point)
+        previous = densities.get(key)
+        if previous:
+            # Blend with earlier fetches of other extents around the same cell
+            edges_per_km2 = (previous["edges_per_km2"] + edges_per_km2) / 2
+            polygons_per_km2 = (previous["polygons_per_km2"] + polygons_per_km2) / 2
+        densities[key] = {
+            "edges_per_km2": round(edges_per_km2, 1),
+            "polygons_per_km2": round(polygons_per_km2, 2),
+            "updated": time.time(),
+        }
+        os.makedirs(os.path.dirname(DENSITY_FILE), exist_ok=True)
+        tmp_path = f"{DENSITY_FILE}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(densities, f, indent=1)
+        os.replace(tmp_path, DENSITY_FILE)
+
+
+class _Ticket:
+    __slots__ = ("nbytes", "rank", "client", "since", "slots")
+
+    def __init__(self, nbytes, rank, client, since, slots=1):
+        self.nbytes = nbytes
+        self.rank = rank
+        self.client = client
+        self.since = since
+        self.slots = slots
+
+
+class Reservation:
+    """
+    An admitted job's hold on the budget, as yielded by
+    AdmissionController.reserve.
+    """
+
+    def __init__(self, controller, ticket, on_wait):
+        self._controller = controller
+        self._ticket = ticket
+        self._on_wait = on_wait
+
+    def checkpoint(self, stage=None):
+        """
+        Called by a job between stages (see create_poster). If work of a
+        higher priority class is waiting, hands the job's render slot over
+        and waits to get one back; the job's memory stays reserved.
+        Returns True if the job yielded.
+        """
+        return self._controller._yield(self._ticket, self._on_wait)
+
+
+class AdmissionController:
+    """
+    Admits jobs against a memory budget in bytes and a number of render
+    slots (0 = no limit).
+
+    Waiting jobs are ordered by priority class (PRIORITY_CLASSES), then by
+    how many jobs their client has been admitted since it last went idle, so
+    one client's batch cannot crowd out everyone else, then by arrival. A job that fits may
+    overtake earlier ones that do not fit yet, so small jobs keep flowing
+    while a large one waits for memory; once a job has waited
+    starvation_seconds nothing overtakes it any more. A job also moves up
+    one class for every starvation_seconds it waits, so print jobs are
+    never starved by a steady stream of interactive ones.
+    """
+
+    def __init__(self, budget_bytes, slots=0, starvation_seconds=30):
+        self.budget_bytes = budget_bytes
+        self.slots = slots
+        self.starvation_seconds = starvation_seconds
+        self.in_use = 0
+        self.running = 0
+        self._clients = {}
+        self._served = {}
+        self._waiting = []
+        self._wait_times = {priority: deque(maxlen=WAIT_SAMPLES) for priority in PRIORITY_CLASSES}
+        self._cond = threading.Condition()
+
+    def check(self, nbytes):
+        """
+        Raises ValueError if a job of nbytes could never be admitted.
+        """
+        if nbytes > self.budget_bytes:
+            raise ValueError(
+                f"This poster would need about {nbytes / MB:,.0f} MB of memory, more than the "
+                f"{self.budget_bytes / MB:,.0f} MB render budget. Try a smaller distance."
+            )
+
+    def admissible_bytes(self, estimate, key="peak_bytes"):
+        """
+        Returns the bytes to reserve for estimate[key] (see estimate_job).
+        An area never fetched before is estimated from default densities, so
+        its estimate is capped at the budget: the job then runs alone, and
+        its fetch records the real density for next time.
+        """
+        if estimate["known_area"]:
+            return estimate[key]
+        return min(estimate[key], self.budget_bytes)
+
+    def _order(self, ticket, now):
+        aged_rank = ticket.rank - int((now - ticket.since) // self.starvation_seconds)
+        return (aged_rank, self._served.get(ticket.client, 0), ticket.since)
+
+    def _fits(self, ticket):
+        if self.slots and self.running + ticket.slots > self.slots:
+            return False
+        return self.in_use + ticket.nbytes <= self.budget_bytes
+
+    def _can_admit(self, ticket):
+        now = time.monotonic()
+        for other in sorted(self._waiting, key=lambda waiting: self._order(waiting, now)):
+            if other is ticket:
+                return self._fits(ticket)
+            if self._fits(other) or now - other.since >= self.starvation_seconds:
+                return False
+        return False
+
+    def _wait(self, ticket, on_wait, queued=False):
+        if not queued:
+            self._waiting.append(ticket)
+        if not self._can_admit(ticket) and on_wait:
+            on_wait()
+        while not self._can_admit(ticket):
+            # Wake up now and then: waiting jobs age even when nothing finishes
+            self._cond.wait(timeout=1)
+        self._waiting.remove(ticket)
+        self.in_use += ticket.nbytes
+        self.running += ticket.slots
+        self._clients[ticket.client] = self._clients.get(ticket.client, 0) + 1
+        if not queued:
+            # A job re-admitted after yielding its slot was counted already
+            self._served[ticket.client] = self._served.get(ticket.client, 0) + 1
+        self._cond.notify_all()
+
+    def _release(self, nbytes, client, slots=1):
+        self.in_use -= nbytes
+        self.running -= slots
+        self._clients[client] -= 1
+        if not self._clients[client]:
+            del self._clients[client]
+            if not any(ticket.client == client for ticket in self._waiting):
+                # An idle client starts from zero next time
+                self._served.pop(client, None)
+        self._cond.notify_all()
+
+    def _yield(self, ticket, on_wait):
+        with self._cond:
+            if not any(
+                other.rank < ticket.rank and self.in_use + other.nbytes <= self.budget_bytes
+                for other in self._waiting
+            ):
+                return False
+            # The memory is still held, so only slots are waited for. The
+            # request is queued before the slots are given up, so the client
+            # is not taken for idle and keeps its count of admissions.
+            waiter = _Ticket(0, ticket.rank, ticket.client, time.monotonic(), ticket.slots)
+            self._waiting.append(waiter)
+            self._release(0, ticket.client, ticket.slots)
+            self._wait(waiter, on_wait, queued=True)
+        return True
+
+    @contextmanager
+    def reserve(self, nbytes, priority="interactive", client=None, on_wait=None, slots=1):
+        """
+        Holds nbytes of the budget and slots render slots (at most all of
+        them) for the duration of the with block, waiting until they are
+        free, and yields a Reservation. on_wait is called whenever the job
+        has to wait.
+        """
+        self.check(nbytes)
+        if self.slots:
+            slots = min(slots, self.slots)
+        ticket = _Ticket(nbytes, PRIORITY_CLASSES.index(priority), client, time.monotonic(), slots)
+        with self._cond:
+            self._wait(ticket, on_wait)
+            self._wait_times[priority].append(time.monotonic() - ticket.since)
+        try:
+            yield Reservation(self, ticket, on_wait)
+        finally:
+            with self._cond:
+                self._release(nbytes, client, slots)
+
+    def usage(self):
+        with self._cond:
+            waiting = {priority: 0 for priority in PRIORITY_CLASSES}
+            for ticket in self._waiting:
+                waiting[PRIORITY_CLASSES[ticket.rank]] += 1
+            return {
+                "budget_bytes": self.budget_bytes,
+                "in_use_bytes": self.in_use,
+                "slots": self.slots,
+                "running": self.running,
+                "waiting": waiting,
+                "p95_wait_seconds": {
+                    priority: _percentile(samples, 95) for priority, samples in self._wait_times.items()
+                },
+            }
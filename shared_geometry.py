@@ -0,0 +1,95 @@
+"""
+Geometry and output buffers shared between render processes.
+
+The arrays built by create_map_poster.pack_map_data are written once as .npy
+files into a private directory, under /dev/shm where it exists so the data
+stays in memory. Workers attach with np.load(mmap_mode='r'): every process
+maps the same pages, nothing is pickled, and only the directory path crosses
+the process boundary.
+
+/dev/shm is a size-limited tmpfs (64 MB by default in a Docker container).
+Filling it up makes writes into a mapped buffer crash the process with
+SIGBUS, so a directory that would not fit there with some headroom left is
+put in the ordinary temp directory instead. Mapping works the same there,
+only the pages are also written back to disk.
+
+Memory-mapped files are used rather than multiprocessing.shared_memory
+because attaching a SharedMemory block registers it with the resource tracker
+of each worker, which may unlink it while other workers still need it.
+"""
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+SHARED_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+# Left free in SHARED_DIR for everything else that uses it
+SHARED_HEADROOM_BYTES = 64 * 1024 * 1024
+
+_lock = threading.Lock()
+# Buffers allocated in SHARED_DIR take up their space only once written, so
+# their full size is counted against its free space until released
+_sparse_bytes = {}
+_warned = False
+
+
+def _make_dir(prefix, nbytes, sparse=False):
+    global _warned
+    with _lock:
+        directory = None
+        if SHARED_DIR:
+            try:
+                free = shutil.disk_usage(SHARED_DIR).free - sum(_sparse_bytes.values())
+            except OSError:
+                free = 0
+            if nbytes + SHARED_HEADROOM_BYTES <= free:
+                directory = SHARED_DIR
+            elif not _warned:
+                print(f"⚠ Not enough space in {SHARED_DIR}, sharing render data through {tempfile.gettempdir()}")
+                _warned = True
+        path = tempfile.mkdtemp(prefix=prefix, dir=directory)
+        if directory and sparse:
+            _sparse_bytes[path] = nbytes
+    return path
+
+
+def publish(packed):
+    """
+    Writes packed geometry to a new shared directory and returns its path.
+    Call release when every render using it has finished.
+    """
+    path = _make_dir("map_geometry_", sum(np.asarray(array).nbytes for array in packed.values()))
+    for key, array in packed.items():
+        np.save(os.path.join(path, f"{key}.npy"), np.ascontiguousarray(array))
+    return path
+
+
+def allocate(name, shape, dtype=np.uint8):
+    """
+    Creates a zero-filled shared array, e.g. an output buffer that render
+    processes fill in parts, and returns the path of its directory.
+    """
+    path = _make_dir("map_buffer_", int(np.prod(shape)) * np.dtype(dtype).itemsize, sparse=True)
+    array = np.lib.format.open_memmap(os.path.join(path, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape)
+    del array
+    return path
+
+
+def attach(path, writable=False):
+    """
+    Maps published geometry or an allocated buffer. The arrays are
+    read-only unless writable is set.
+    """
+    return {
+        name[:-4]: np.load(os.path.join(path, name), mmap_mode="r+" if writable else "r")
+        for name in os.listdir(path)
+        if name.endswith(".npy")
+    }
+
+
+def release(path):
+    shutil.rmtree(path, ignore_errors=True)
+    with _lock:
+        _sparse_bytes.pop(path, None)
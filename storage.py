@@ -0,0 +1,215 @@
+import os
+import shutil
+import threading
+import time
+
+DAY_SECONDS = 24 * 60 * 60
+MB = 1024 * 1024
+
+
+class StorageManager:
+    """
+    Keeps the posters and trash folders within size and age quotas.
+
+    File sizes and modification times are held in an in-memory index that is
+    updated as the web UI adds, moves and removes files. Each folder's
+    directory mtime is checked on every call, so files written or removed
+    behind our back (CLI runs, manual cleanup) trigger a rescan of that one
+    folder; otherwise no directory walk happens.
+
+    A limit of 0 means "no limit". Eviction removes the oldest files first,
+    by the time they were written, restored or trashed (downloads do not
+    count as use), emptying the trash before touching any poster. Evicting
+    for free disk space removes at most max_free_space_eviction_bytes per
+    enforce call, and nothing if that could not reach min_free_bytes, so
+    a disk filled by something else does not wipe out every poster.
+    """
+
+    def __init__(
+        self,
+        posters_dir,
+        trash_dir,
+        posters_max_bytes=0,
+        posters_max_age_days=0,
+        trash_max_bytes=0,
+        trash_max_age_days=0,
+        min_free_bytes=0,
+        max_free_space_eviction_bytes=0,
+    ):
+        self.posters_dir = posters_dir
+        self.trash_dir = trash_dir
+        self.limits = {
+            posters_dir: (posters_max_bytes, posters_max_age_days),
+            trash_dir: (trash_max_bytes, trash_max_age_days),
+        }
+        self.min_free_bytes = min_free_bytes
+        self.max_free_space_eviction_bytes = max_free_space_eviction_bytes
+        self._files = {posters_dir: {}, trash_dir: {}}
+        self._bytes = {posters_dir: 0, trash_dir: 0}
+        self._dir_mtimes = {}
+        self._lock = threading.RLock()
+
+    def _sync(self, folder):
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if self._dir_mtimes.get(folder) == mtime:
+            return
+
+        files = {}
+        if mtime is not None:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        files[entry.name] = (stat.st_size, stat.st_mtime)
+        self._files[folder] = files
+        self._bytes[folder] = sum(size for size, _ in files.values())
+        self._dir_mtimes[folder] = mtime
+
+    def _record(self, folder, filename):
+        if folder not in self._dir_mtimes:
+            self._sync(folder)
+            return
+        path = os.path.join(folder, filename)
+        previous = self._files[folder].pop(filename, None)
+        if previous:
+            self._bytes[folder] -= previous[0]
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            self._files[folder][filename] = (stat.st_size, stat.st_mtime)
+            self._bytes[folder] += stat.st_size
+        # Our own change bumped the directory mtime; note it so the next call
+        # does not mistake it for an outside change and rescan.
+        self._dir_mtimes[folder] = os.stat(folder).st_mtime_ns
+
+    def record(self, folder, *filenames):
+        """
+        Updates the index after files in folder were written, moved or removed.
+        """
+        with self._lock:
+            for filename in filenames:
+                self._record(folder, filename)
+
+    def touch(self, folder, filename):
+        """
+        Marks a file as new, e.g. when it is restored or trashed.
+        """
+        path = os.path.join(folder, filename)
+        if os.path.exists(path):
+            os.utime(path)
+        self.record(folder, filename)
+
+    def list_files(self, folder, extensions=None):
+        with self._lock:
+            self._sync(folder)
+            names = sorted(self._files[folder])
+        if extensions:
+            names = [name for name in names if name.lower().endswith(extensions)]
+        return names
+
+    def _remove(self, folder, filename):
+        try:
+            os.remove(os.path.join(folder, filename))
+        except FileNotFoundError:
+            pass
+        size, _ = self._files[folder].pop(filename, (0, 0))
+        self._bytes[folder] -= size
+        return size
+
+    def _oldest_first(self, folder):
+        return sorted(self._files[folder].items(), key=lambda item: item[1][1])
+
+    def purge(self, folder, filenames=None, older_than_days=0):
+        """
+        Removes the given files from folder, or every file when filenames is
+        None, skipping files used within the last older_than_days days.
+        Returns the removed filenames and the bytes freed.
+        """
+        removed = []
+        freed = 0
+        cutoff = time.time() - older_than_days * DAY_SECONDS
+        with self._lock:
+            self._sync(folder)
+            candidates = list(self._files[folder]) if filenames is None else filenames
+            for filename in candidates:
+                entry = self._files[folder].get(filename)
+                if entry is None or (older_than_days and entry[1] > cutoff):
+                    continue
+                freed += self._remove(folder, filename)
+                removed.append(filename)
+            self._dir_mtimes[folder] = os.stat(folder).st_mtime_ns
+        return removed, freed
+
+    def _evict_until(self, folder, over_quota):
+        evicted = []
+        for filename, _ in self._oldest_first(folder):
+            if not over_quota():
+                break
+            self._remove(folder, filename)
+            evicted.append(filename)
+        return evicted
+
+    def _free_bytes(self):
+        return shutil.disk_usage(self.posters_dir).free
+
+    def enforce(self):
+        """
+        Applies age limits, then size limits, then the free-space floor.
+        Returns the evicted files per folder.
+        """
+        evicted = {self.posters_dir: [], self.trash_dir: []}
+        with self._lock:
+            now = time.time()
+            for folder, (max_bytes, max_age_days) in self.limits.items():
+                self._sync(folder)
+                if max_age_days:
+                    cutoff = now - max_age_days * DAY_SECONDS
+                    for filename, (_, used_at) in list(self._files[folder].items()):
+                        if used_at < cutoff:
+                            self._remove(folder, filename)
+                            evicted[folder].append(filename)
+
+            # Trash goes first: a poster is only evicted once the trash is empty
+            for folder in (self.trash_dir, self.posters_dir):
+                max_bytes, _ = self.limits[folder]
+                if max_bytes:
+                    evicted[folder] += self._evict_until(folder, lambda: self._bytes[folder] > max_bytes)
+
+            if self.min_free_bytes:
+                shortfall = self.min_free_bytes - self._free_bytes()
+                stored = self._bytes[self.trash_dir] + self._bytes[self.posters_dir]
+                cap = self.max_free_space_eviction_bytes
+                if 0 < shortfall <= stored and (not cap or shortfall <= cap):
+                    for folder in (self.trash_dir, self.posters_dir):
+                        evicted[folder] += self._evict_until(
+                            folder,
+                            lambda: self._bytes[self.trash_dir] + self._bytes[self.posters_dir] > stored - shortfall,
+                        )
+
+            for folder, names in evicted.items():
+                if names:
+                    self._dir_mtimes[folder] = os.stat(folder).st_mtime_ns
+        return evicted
+
+    def usage(self):
+        with self._lock:
+            report = {}
+            for key, folder in (("posters", self.posters_dir), ("trash", self.trash_dir)):
+                self._sync(folder)
+                max_bytes, max_age_days = self.limits[folder]
+                report[key] = {
+                    "files": len(self._files[folder]),
+                    "bytes": self._bytes[folder],
+                    "max_bytes": max_bytes,
+                    "max_age_days": max_age_days,
+                }
+        disk = shutil.disk_usage(self.posters_dir)
+        report["disk"] = {
+            "total_bytes": disk.total,
+            "used_bytes": disk.used,
+            "free_bytes": disk.free,
+            "min_free_bytes": self.min_free_bytes,
+        }
+        return report
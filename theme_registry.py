@@ -0,0 +1,133 @@
+"""
+In-memory registry of the JSON themes in themes/.
+
+Each theme file is parsed and validated once, and its colours are compiled to
+RGBA tuples so rendering never parses colour strings. The registry notices
+changes by mtime: the themes directory is re-listed only when its own mtime
+changes (a theme was added, removed or replaced), and a theme file is
+recompiled only when its mtime changes, so edits show up on the next render
+without restarting the web UI. A theme that fails validation is reported
+once and left out; if it was valid before, the last good version stays in use.
+"""
+import json
+import os
+import threading
+
+import matplotlib.colors as mcolors
+
+COLOR_KEYS = (
+    "bg",
+    "text",
+    "gradient_color",
+    "water",
+    "parks",
+    "road_motorway",
+    "road_primary",
+    "road_secondary",
+    "road_tertiary",
+    "road_residential",
+    "road_default",
+)
+
+
+def compile_theme(theme_id, data):
+    """
+    Validates theme data and returns a new theme dict with its id set and
+    an 'rgba' dict holding every colour as an RGBA tuple.
+    Raises ValueError if a colour is missing or invalid.
+    """
+    invalid = [key for key in COLOR_KEYS if not mcolors.is_color_like(data.get(key))]
+    if invalid:
+        raise ValueError(f"missing or invalid colours: {', '.join(invalid)}")
+    theme = dict(data)
+    theme["id"] = theme_id
+    theme["rgba"] = {key: mcolors.to_rgba(data[key]) for key in COLOR_KEYS}
+    return theme
+
+
+def css_colors(theme):
+    """
+    Returns the colours of a compiled theme as CSS hex strings (#rrggbbaa).
+    """
+    return {key: mcolors.to_hex(rgba, keep_alpha=True) for key, rgba in theme["rgba"].items()}
+
+
+class ThemeRegistry:
+    """
+    Compiled themes by name. Returned theme dicts are shared between callers
+    and must be treated as read-only.
+    """
+
+    def __init__(self, themes_dir):
+        self.themes_dir = themes_dir
+        self._themes = {}
+        self._file_mtimes = {}
+        self._failed = {}
+        self._dir_mtime = None
+        self._lock = threading.Lock()
+
+    def _compile(self, name):
+        path = os.path.join(self.themes_dir, f"{name}.json")
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self._themes.pop(name, None)
+            self._file_mtimes.pop(name, None)
+            self._failed.pop(name, None)
+            return
+        if self._file_mtimes.get(name) == mtime or self._failed.get(name) == mtime:
+            return
+
+        try:
+            with open(path, "r") as f:
+                theme = compile_theme(name, json.load(f))
+        except (OSError, ValueError) as exc:
+            # Report a broken file once, not on every request
+            self._failed[name] = mtime
+            print(f"⚠ Theme '{name}' is invalid: {exc}")
+            return
+
+        self._failed.pop(name, None)
+        self._themes[name] = theme
+        self._file_mtimes[name] = mtime
+        print(f"✓ Loaded theme: {theme.get('name', name)}")
+        if "description" in theme:
+            print(f"  {theme['description']}")
+
+    def _sync(self):
+        try:
+            mtime = os.stat(self.themes_dir).st_mtime_ns
+        except FileNotFoundError:
+            os.makedirs(self.themes_dir, exist_ok=True)
+            mtime = os.stat(self.themes_dir).st_mtime_ns
+        if mtime == self._dir_mtime:
+            return
+
+        names = {file[:-5] for file in os.listdir(self.themes_dir) if file.endswith(".json")}
+        for name in set(self._themes) - names:
+            del self._themes[name]
+            del self._file_mtimes[name]
+        for name in set(self._failed) - names:
+            del self._failed[name]
+        for name in sorted(names):
+            self._compile(name)
+        self._dir_mtime = mtime
+
+    def names(self):
+        """
+        Returns the sorted names of all valid themes.
+        """
+        with self._lock:
+            self._sync()
+            return sorted(self._themes)
+
+    def get(self, name):
+        """
+        Returns the compiled theme, recompiling it if its file changed,
+        or None if there is no valid theme of that name.
+        """
+        with self._lock:
+            self._sync()
+            if name in self._themes or name in self._failed:
+                self._compile(name)
+            return self._themes.get(name)
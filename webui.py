@@ -1,35 +1,97 @@
+import multiprocessing
 import os
 import threading
 import time
 import uuid
-import ssl
-import certifi
+from collections import OrderedDict
 import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import nullcontext
 from PIL import Image
+import httpx
+from pydantic import BaseModel
 import strawberry
 from strawberry.fastapi import GraphQLRouter
 from fastapi import FastAPI, Form, Request
-from fastapi.responses import HTMLResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from geopy.geocoders import Nominatim
 
 from create_map_poster import (
-    create_poster,
+    BANDS_PER_PROCESS,
+    OUTPUT_DPI,
+    OUTPUT_FIGSIZE,
+    OUTPUT_FORMATS,
+    ROAD_CLASS_ORDER,
+    ROAD_WIDTHS,
+    detail_dpi,
+    fetch_map_data,
     generate_output_filename,
     get_available_themes,
     get_coordinates,
     load_theme,
+    optimize_png,
+    pack_map_data,
+    parse_output_spec,
+    render_poster,
+    render_shared_poster,
+    variant_filename,
 )
+import cache_warmer
+import gazetteer
+import geocode_cache
+import geocoder
+import geometry_payload
+import profiling
+import shared_geometry
+from scheduler import (
+    PRIORITY_CLASSES,
+    AdmissionController,
+    estimate_job,
+    physical_memory_bytes,
+    process_memory_bytes,
+    record_map_data,
+)
+from storage import MB, StorageManager
+from theme_registry import css_colors
 
 POSTERS_DIR = "posters"
 EXAMPLES_DIR = "examples"
 TRASH_DIR = "trashcan"
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "2"))
+RENDER_PROCESSES = int(os.environ.get("RENDER_PROCESSES", "0"))
+MAX_BATCH_ITEMS = 50
+PNG_COMPRESSION = os.environ.get("PNG_COMPRESSION", "fast")
+PNG_MODE = os.environ.get("PNG_MODE", "auto")
+OPTIMIZE_PNG = os.environ.get("OPTIMIZE_PNG", "1") == "1"
+RENDER_MEMORY_MB = int(os.environ.get("RENDER_MEMORY_MB", str(int(physical_memory_bytes() * 0.7) // MB)))
+MAX_CONCURRENT_RENDERS = int(os.environ.get("MAX_CONCURRENT_RENDERS", str(os.cpu_count() or 2)))
+# Single jobs expected to download more edges than this run as "print" jobs
+INTERACTIVE_MAX_EDGES = int(os.environ.get("INTERACTIVE_MAX_EDGES", "250000"))
+# Encoded geometry of recently previewed areas, for re-theming in the browser
+GEOMETRY_CACHE_ITEMS = int(os.environ.get("GEOMETRY_CACHE_ITEMS", "16"))
+# Places warmed into the geocode and map-data caches per hour in idle time
+# (0 = off), from the request history and WARM_PLACES_FILE or the examples
+WARM_REQUESTS_PER_HOUR = float(os.environ.get("WARM_REQUESTS_PER_HOUR", "0"))
+WARM_PLACES_FILE = os.environ.get("WARM_PLACES_FILE", "")
+POSTER_EXTENSIONS = tuple(f".{output_format}" for output_format in OUTPUT_FORMATS)
 
 os.makedirs(POSTERS_DIR, exist_ok=True)
 os.makedirs(EXAMPLES_DIR, exist_ok=True)
 os.makedirs(TRASH_DIR, exist_ok=True)
 
+storage = StorageManager(
+    POSTERS_DIR,
+    TRASH_DIR,
+    posters_max_bytes=int(os.environ.get("POSTERS_MAX_MB", "0")) * MB,
+    posters_max_age_days=float(os.environ.get("POSTERS_MAX_AGE_DAYS", "0")),
+    trash_max_bytes=int(os.environ.get("TRASH_MAX_MB", "0")) * MB,
+    trash_max_age_days=float(os.environ.get("TRASH_MAX_AGE_DAYS", "0")),
+    min_free_bytes=int(os.environ.get("STORAGE_MIN_FREE_MB", "0")) * MB,
+    max_free_space_eviction_bytes=int(os.environ.get("STORAGE_MAX_EVICT_MB", "1024")) * MB,
+)
+
 app = FastAPI(title="Map Poster Studio")
 
 templates = Jinja2Templates(directory="templates")
@@ -38,35 +100,130 @@ app.mount("/posters", StaticFiles(directory=POSTERS_DIR), name="posters")
 app.mount("/examples", StaticFiles(directory=EXAMPLES_DIR), name="examples")
 app.mount("/trashcan", StaticFiles(directory=TRASH_DIR), name="trashcan")
 
+# Every fetch and render reserves its estimated memory and a render slot here
+# first (see scheduler)
+admission = AdmissionController(RENDER_MEMORY_MB * MB, slots=MAX_CONCURRENT_RENDERS)
+_render_pool = ThreadPoolExecutor(max_workers=max(RENDER_WORKERS, RENDER_PROCESSES), thread_name_prefix="render")
+# With RENDER_PROCESSES set, batch renders are drawn in worker processes that
+# map each area's geometry from shared memory, and single raster posters are
+# split into bands across them; the render threads only track them. Spawned
+# rather than forked, since the server process runs threads.
+_process_pool = (
+    ProcessPoolExecutor(max_workers=RENDER_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    if RENDER_PROCESSES > 0
+    else None
+)
+# Single raster posters are drawn in this many bands across the processes
+SPLIT_BANDS = RENDER_PROCESSES * BANDS_PER_PROCESS if RENDER_PROCESSES > 1 else 0
+# Posters are encoded fast and marked done first; the slow maximum-compression
+# pass runs afterwards on a single background thread.
+_optimize_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="optimize")
+# Held while a poster is moved to or from the trash, so the optimizer never
+# puts back a poster that was moved while it was being re-encoded
+_poster_move_lock = threading.Lock()
+# Idle-time warming yields to every job admitted by the same controller
+_cache_warmer = (
+    cache_warmer.CacheWarmer(
+        WARM_REQUESTS_PER_HOUR,
+        places=cache_warmer.load_places(WARM_PLACES_FILE) if WARM_PLACES_FILE else cache_warmer.DEFAULT_PLACES,
+        admission=admission,
+    )
+    if WARM_REQUESTS_PER_HOUR > 0
+    else None
+)
+
+_geometry_cache = OrderedDict()
+_geometry_lock = threading.Lock()
+
 _jobs = {}
+_job_expiry = OrderedDict()
 _jobs_lock = threading.Lock()
 JOB_TTL_SECONDS = 6 * 60 * 60
+JOB_EVICT_BATCH = 64
+JOB_REAP_INTERVAL_SECONDS = 60
+
+# Job payloads are never mutated once stored; writers swap in a new dict under
+# _jobs_lock, so readers can look a job up without taking the lock.
+# _job_expiry keeps job ids in last-update order, which means the expired jobs
+# are always a prefix of it and eviction never has to scan live entries.
+
+
+def _evict_expired_jobs(now_ts, limit):
+    evicted = 0
+    while _job_expiry and evicted < limit:
+        job_id, touched_at = next(iter(_job_expiry.items()))
+        if now_ts - touched_at <= JOB_TTL_SECONDS:
+            break
+        _job_expiry.popitem(last=False)
+        _jobs.pop(job_id, None)
+        evicted += 1
+    return evicted
 
 
-def _prune_jobs(now_ts):
-    stale = [job_id for job_id, payload in _jobs.items() if now_ts - payload.get("updated_at", now_ts) > JOB_TTL_SECONDS]
-    for job_id in stale:
-        _jobs.pop(job_id, None)
+def _store_job(job_id, payload):
+    now_ts = time.monotonic()
+    _jobs[job_id] = {**payload, "updated_at": time.time()}
+    _job_expiry[job_id] = now_ts
+    _job_expiry.move_to_end(job_id)
+    _evict_expired_jobs(now_ts, JOB_EVICT_BATCH)
 
 
 def _set_job(job_id, payload):
     with _jobs_lock:
-        now_ts = time.time()
-        _prune_jobs(now_ts)
-        _jobs[job_id] = {**payload, "updated_at": now_ts}
+        _store_job(job_id, payload)
 
 
 def _update_job(job_id, updates):
     with _jobs_lock:
-        now_ts = time.time()
-        _prune_jobs(now_ts)
-        _jobs[job_id] = {**_jobs.get(job_id, {}), **updates, "updated_at": now_ts}
+        _store_job(job_id, {**_jobs.get(job_id, {}), **updates})
 
 
 def _get_job(job_id):
-    with _jobs_lock:
-        _prune_jobs(time.time())
-    return _jobs.get(job_id)
+    job = _jobs.get(job_id)
+    touched_at = _job_expiry.get(job_id)
+    if job is None or touched_at is None or time.monotonic() - touched_at > JOB_TTL_SECONDS:
+        return None
+    return job
+
+
+def _reap_jobs():
+    while True:
+        time.sleep(JOB_REAP_INTERVAL_SECONDS)
+        evicted = JOB_EVICT_BATCH
+        while evicted == JOB_EVICT_BATCH:
+            with _jobs_lock:
+                evicted = _evict_expired_jobs(time.monotonic(), JOB_EVICT_BATCH)
+
+
+@app.on_event("startup")
+def _start_job_reaper():
+    threading.Thread(target=_reap_jobs, daemon=True).start()
+
+
+@app.on_event("startup")
+def _enforce_storage_quotas():
+    threading.Thread(target=storage.enforce, daemon=True).start()
+
+
+@app.on_event("startup")
+def _load_gazetteer():
+    threading.Thread(target=gazetteer.available, daemon=True).start()
+
+
+@app.on_event("startup")
+def _start_cache_warmer():
+    if _cache_warmer:
+        _cache_warmer.start()
+
+
+@app.on_event("shutdown")
+async def _close_geocoder():
+    await geocoder.aclose()
+
+
+@app.on_event("shutdown")
+def _flush_request_history():
+    cache_warmer.flush_history()
 
 
 def _get_png_metadata(path):
@@ -105,9 +262,7 @@ def _list_examples(themes):
 
 def _list_posters(folder, url_prefix):
     posters = []
-    for filename in sorted(os.listdir(folder)):
-        if not filename.lower().endswith(".png"):
-            continue
+    for filename in storage.list_files(folder, POSTER_EXTENSIONS):
         path = os.path.join(folder, filename)
         meta = _get_png_metadata(path)
         posters.append(
@@ -129,6 +284,7 @@ def _render_index(request, themes, values=None, result=None, error=None):
         {
             "request": request,
             "themes": themes,
+            "formats": OUTPUT_FORMATS,
             "examples": examples,
             "posters": posters,
             "trash": trash,
@@ -147,6 +303,7 @@ def index(request: Request):
         "country": "",
         "theme": "feature_based",
         "distance": 29000,
+        "format": "png",
     }
     return _render_index(request, themes, values=defaults)
 
@@ -158,6 +315,7 @@ def generate(
     country: str = Form(...),
     theme: str = Form("feature_based"),
     distance: int = Form(29000),
+    output_format: str = Form("png"),
 ):
     themes = get_available_themes()
     values = {
@@ -165,6 +323,7 @@ def generate(
         "country": country.strip(),
         "theme": theme,
         "distance": distance,
+        "format": output_format.lower(),
     }
 
     if not values["city"] or not values["country"]:
@@ -176,22 +335,26 @@ def generate(
     if distance <= 0:
         return _render_index(request, themes, values=values, error="Distance must be positive.")
 
+    if values["format"] not in OUTPUT_FORMATS:
+        return _render_index(request, themes, values=values, error="Unsupported output format.")
+
     try:
-        theme_data = load_theme(theme)
         coords = get_coordinates(values["city"], values["country"])
-        output_file = generate_output_filename(values["city"], theme)
-        create_poster(
-            values["city"],
-            values["country"],
-            coords,
-            distance,
-            output_file,
-            theme_data,
-            show_progress=False,
-        )
+        cache_warmer.record_request(values["city"], values["country"], distance)
+        estimate = estimate_job(coords, distance, values["format"], bands=SPLIT_BANDS, band_workers=RENDER_PROCESSES)
+        output_file = generate_output_filename(values["city"], theme, values["format"])
+        priority = _job_priority("", estimate)
+        with admission.reserve(
+            admission.admissible_bytes(estimate),
+            priority=priority,
+            client=_client_id(request),
+            slots=estimate["slots"],
+        ) as reservation:
+            _fetch_and_render(values, coords, output_file, reservation.checkpoint)
     except Exception as exc:
         return _render_index(request, themes, values=values, error=str(exc))
 
+    _finish_poster(output_file)
     result = {
         "filename": os.path.basename(output_file),
         "path": f"/posters/{os.path.basename(output_file)}",
@@ -199,65 +362,231 @@ def generate(
     return _render_index(request, themes, values=values, result=result)
 
 
-def _run_job(job_id, values):
+def _optimize_poster(output_file):
+    try:
+        if optimize_png(output_file, lock=_poster_move_lock):
+            storage.record(POSTERS_DIR, os.path.basename(output_file))
+    except Exception as exc:
+        print(f"⚠ Could not optimize {output_file}: {exc}")
+
+
+def _finish_poster(output_file):
+    storage.record(POSTERS_DIR, os.path.basename(output_file))
+    storage.enforce()
+    if OPTIMIZE_PNG and output_file.lower().endswith(".png"):
+        _optimize_pool.submit(_optimize_poster, output_file)
+
+
+def _validation_error(values, themes):
+    if not values["city"] or not values["country"]:
+        return "City and country are required."
+    if values["theme"] not in themes:
+        return "Theme not found."
+    if values["distance"] <= 0:
+        return "Distance must be positive."
+    if values["format"] not in OUTPUT_FORMATS:
+        return "Unsupported output format."
+    return None
+
+
+def _client_id(request):
+    # Fair share is per client: an explicit id if the caller sends one,
+    # otherwise the remote address
+    client_id = request.headers.get("x-client-id")
+    if client_id:
+        return client_id
+    return request.client.host if request.client else None
+
+
+def _job_priority(requested, estimate):
+    derived = "print" if estimate["edges"] > INTERACTIVE_MAX_EDGES else "interactive"
+    # Clients may lower their job's priority, never raise it
+    return max(derived, requested or derived, key=PRIORITY_CLASSES.index)
+
+
+def _parse_sizes(text, default_format):
+    # Output specs separated by commas or spaces, e.g. "12x16@300, 24x36@150.pdf"
+    return [parse_output_spec(spec, default_format) for spec in text.replace(",", " ").split()]
+
+
+def _output_status(spec):
+    width, height = spec["figsize"]
+    return {
+        "filename": os.path.basename(spec["file"]),
+        "path": f"/posters/{os.path.basename(spec['file'])}",
+        "format": spec["format"],
+        "width": width,
+        "height": height,
+        "dpi": spec["dpi"],
+    }
+
+
+def _fetch_and_render(values, coords, output_file, checkpoint=None):
+    """
+    Fetches and renders one poster job. With output specs in
+    values["outputs"] every variant is saved from one render, next to
+    output_file; returns the specs with the files written.
+    """
+    outputs = [{**spec, "file": variant_filename(output_file, spec)} for spec in values.get("outputs") or []]
+    dpi = detail_dpi(outputs) if outputs else OUTPUT_DPI
+    map_data = fetch_map_data(coords, values["distance"], show_progress=False, dpi=dpi)
+    record_map_data(coords, values["distance"], map_data, dpi=dpi)
+    if checkpoint:
+        checkpoint("draw")
+    render_poster(
+        values["city"],
+        values["country"],
+        coords,
+        values["distance"],
+        output_file,
+        load_theme(values["theme"]),
+        map_data,
+        png_compression=PNG_COMPRESSION,
+        png_mode=PNG_MODE,
+        checkpoint=checkpoint,
+        executor=_process_pool,
+        bands=SPLIT_BANDS,
+        outputs=outputs or None,
+    )
+    return outputs
+
+
+def _profile_status(profile):
+    if not profile:
+        return {}
+    if "skipped" in profile:
+        return {"profile": {"skipped": profile["skipped"]}}
+    # The profile files sit next to the poster and count against its quota
+    names = {kind: os.path.basename(profile[kind]) for kind in profiling.PROFILE_SUFFIXES}
+    storage.record(POSTERS_DIR, *names.values())
+    return {
+        "profile": {
+            **{kind: f"/posters/{name}" for kind, name in names.items()},
+            "seconds": profile["seconds"],
+            "peak_traced_mb": profile["peak_traced_mb"],
+        }
+    }
+
+
+def _run_job(job_id, values, client):
     _update_job(job_id, {"status": "running"})
+    storage.enforce()
+    profile = None
     try:
-        theme_data = load_theme(values["theme"])
+        output_file = generate_output_filename(values["city"], values["theme"], values["format"])
         coords = get_coordinates(values["city"], values["country"])
-        output_file = generate_output_filename(values["city"], values["theme"])
-        create_poster(
-            values["city"],
-            values["country"],
+        cache_warmer.record_request(values["city"], values["country"], values["distance"])
+        # Size the job before downloading anything: too large is rejected,
+        # otherwise it waits here until its memory is free.
+        estimate = estimate_job(
             coords,
             values["distance"],
-            output_file,
-            theme_data,
-            show_progress=False,
+            values["format"],
+            outputs=values["outputs"],
+            bands=SPLIT_BANDS,
+            band_workers=RENDER_PROCESSES,
         )
+        priority = _job_priority(values["priority"], estimate)
+        _update_job(job_id, {"estimated_memory_mb": round(estimate["peak_bytes"] / MB), "priority": priority})
+        with admission.reserve(
+            admission.admissible_bytes(estimate),
+            priority=priority,
+            client=client,
+            on_wait=lambda: _update_job(job_id, {"status": "queued"}),
+            slots=estimate["slots"],
+        ) as reservation:
+            _update_job(job_id, {"status": "running"})
+
+            def checkpoint(stage):
+                # Long jobs step aside here for waiting interactive ones
+                if reservation.checkpoint(stage):
+                    _update_job(job_id, {"status": "running"})
+
+            # Only the fetch and render are profiled, not the admission wait.
+            # Never wait for another profile here: that run may be yielding
+            # its slot at a checkpoint, so waiting could block it forever.
+            with (
+                profiling.profile_run(output_file, blocking=False) if values["profile"] else nullcontext()
+            ) as profile:
+                outputs = _fetch_and_render(values, coords, output_file, checkpoint)
     except Exception as exc:
-        _update_job(job_id, {"status": "error", "error": str(exc)})
+        # A profile of a failed run is kept too; it often shows why
+        _update_job(job_id, {"status": "error", "error": str(exc), **_profile_status(profile)})
         return
 
+    files = [spec["file"] for spec in outputs] or [output_file]
     _update_job(
         job_id,
         {
             "status": "done",
-            "filename": os.path.basename(output_file),
-            "path": f"/posters/{os.path.basename(output_file)}",
+            "filename": os.path.basename(files[0]),
+            "path": f"/posters/{os.path.basename(files[0])}",
+            **({"outputs": [_output_status(spec) for spec in outputs]} if outputs else {}),
+            **_profile_status(profile),
         },
     )
+    for path in files:
+        _finish_poster(path)
 
 
 @app.post("/api/generate")
 def generate_api(
+    request: Request,
     city: str = Form(...),
     country: str = Form(...),
     theme: str = Form("feature_based"),
     distance: int = Form(29000),
+    output_format: str = Form("png"),
+    priority: str = Form(""),
+    profile: bool = Form(False),
+    sizes: str = Form(""),
 ):
-    themes = get_available_themes()
     values = {
         "city": city.strip(),
         "country": country.strip(),
         "theme": theme,
         "distance": distance,
+        "format": output_format.lower(),
+        "priority": priority.lower(),
+        "profile": profile,
     }
 
-    if not values["city"] or not values["country"]:
-        return {"status": "error", "error": "City and country are required."}
-
-    if theme not in themes:
-        return {"status": "error", "error": "Theme not found."}
-
-    if distance <= 0:
-        return {"status": "error", "error": "Distance must be positive."}
+    error = _validation_error(values, get_available_themes())
+    if not error and values["priority"] and values["priority"] not in PRIORITY_CLASSES:
+        error = "Unknown priority."
+    if not error:
+        try:
+            values["outputs"] = _parse_sizes(sizes, values["format"])
+        except ValueError as exc:
+            error = str(exc)
+    if error:
+        return {"status": "error", "error": error}
 
     job_id = uuid.uuid4().hex
     _set_job(job_id, {"status": "queued"})
-    threading.Thread(target=_run_job, args=(job_id, values), daemon=True).start()
+    threading.Thread(target=_run_job, args=(job_id, values, _client_id(request)), daemon=True).start()
     return {"status": "queued", "job_id": job_id}
 
 
+@app.get("/api/stats")
+def stats_api():
+    with _jobs_lock:
+        jobs = list(_jobs.values())
+    job_counts = {}
+    for job in jobs:
+        status = job.get("status", "unknown")
+        job_counts[status] = job_counts.get(status, 0) + 1
+    rss_bytes, peak_rss_bytes = process_memory_bytes()
+    return {
+        "status": "ok",
+        "jobs": job_counts,
+        "admission": admission.usage(),
+        "memory": {"rss_bytes": rss_bytes, "peak_rss_bytes": peak_rss_bytes},
+        "geocode_cache": geocode_cache.stats(),
+        "cache_warmer": _cache_warmer.stats() if _cache_warmer else None,
+    }
+
+
 @app.get("/api/status/{job_id}")
 def status_api(job_id: str):
     job = _get_job(job_id)
@@ -266,33 +595,316 @@ def status_api(job_id: str):
     return {"status": job.get("status"), **job}
 
 
+class BatchItem(BaseModel):
+    city: str
+    country: str
+    theme: str = "feature_based"
+    distance: int = 29000
+    format: str = "png"
+
+
+class BatchRequest(BaseModel):
+    items: list[BatchItem]
+
+
+def _update_batch_item(batch_id, index, updates):
+    with _jobs_lock:
+        batch = _jobs.get(batch_id, {})
+        items = list(batch.get("items", []))
+        items[index] = {**items[index], **updates}
+        _store_job(
+            batch_id,
+            {
+                **batch,
+                "items": items,
+                "completed": sum(1 for item in items if item["status"] == "done"),
+                "failed": sum(1 for item in items if item["status"] == "error"),
+            },
+        )
+
+
+def _render_batch_item(batch_id, index, values, coords, geometry, output_file, render_bytes, client):
+    # geometry is packed map data, or the path it was published to when
+    # rendering in worker processes
+    args = (values["city"], values["country"], coords, values["distance"], output_file, load_theme(values["theme"]))
+    kwargs = {"png_compression": PNG_COMPRESSION, "png_mode": PNG_MODE}
+    try:
+        with admission.reserve(render_bytes, priority="batch", client=client) as reservation:
+            _update_batch_item(batch_id, index, {"status": "running"})
+            if _process_pool:
+                _process_pool.submit(render_shared_poster, geometry, *args, **kwargs).result()
+            else:
+                render_poster(*args, geometry, checkpoint=reservation.checkpoint, **kwargs)
+    except Exception as exc:
+        _update_batch_item(batch_id, index, {"status": "error", "error": str(exc)})
+        return
+
+    _update_batch_item(
+        batch_id,
+        index,
+        {
+            "status": "done",
+            "filename": os.path.basename(output_file),
+            "path": f"/posters/{os.path.basename(output_file)}",
+        },
+    )
+    _finish_poster(output_file)
+
+
+def _render_batch(batch_id, items, client, futures, shared_paths):
+    # Plan the batch as a whole: each distinct place is geocoded once and each
+    # distinct (place, distance) area is downloaded once. Renders for an area
+    # are handed to the render pool as soon as its data arrives, so downloads
+    # of the next area overlap with drawing the previous one.
+    places = {}
+    for index, values in enumerate(items):
+        place = (values["city"].lower(), values["country"].lower())
+        if place not in places:
+            try:
+                places[place] = get_coordinates(values["city"], values["country"])
+            except Exception as exc:
+                places[place] = exc
+        if isinstance(places[place], Exception):
+            _update_batch_item(batch_id, index, {"status": "error", "error": str(places[place])})
+        else:
+            cache_warmer.record_request(values["city"], values["country"], values["distance"])
+
+    areas = {}
+    for index, values in enumerate(items):
+        coords = places[(values["city"].lower(), values["country"].lower())]
+        if not isinstance(coords, Exception):
+            areas.setdefault((coords, values["distance"]), []).append(index)
+
+    _update_job(batch_id, {"stage": "fetching"})
+    used_files = set()
+    for (coords, distance), indexes in areas.items():
+        estimates = {
+            output_format: estimate_job(coords, distance, output_format)
+            for output_format in {items[index]["format"] for index in indexes}
+        }
+        try:
+            for estimate in estimates.values():
+                admission.check(admission.admissible_bytes(estimate))
+            fetch_bytes = admission.admissible_bytes(next(iter(estimates.values())), "fetch_bytes")
+            with admission.reserve(fetch_bytes, priority="batch", client=client):
+                map_data = fetch_map_data(coords, distance, show_progress=False)
+                record_map_data(coords, distance, map_data)
+                geometry = pack_map_data(map_data)
+                del map_data
+            if _process_pool:
+                geometry = shared_geometry.publish(geometry)
+                shared_paths.append(geometry)
+        except Exception as exc:
+            for index in indexes:
+                _update_batch_item(batch_id, index, {"status": "error", "error": str(exc)})
+            continue
+
+        for index in indexes:
+            values = items[index]
+            output_file = generate_output_filename(values["city"], values["theme"], values["format"])
+            if output_file in used_files:
+                stem, ext = os.path.splitext(output_file)
+                output_file = f"{stem}_{index}{ext}"
+            used_files.add(output_file)
+            futures.append(
+                _render_pool.submit(
+                    _render_batch_item,
+                    batch_id,
+                    index,
+                    values,
+                    coords,
+                    geometry,
+                    output_file,
+                    admission.admissible_bytes(estimates[values["format"]], "render_bytes"),
+                    client,
+                )
+            )
+        del geometry
+
+    _update_job(batch_id, {"stage": "rendering"})
+    for future in futures:
+        future.result()
+
+
+def _run_batch(batch_id, items, client):
+    _update_job(batch_id, {"status": "running", "stage": "geocoding"})
+    storage.enforce()
+    futures = []
+    shared_paths = []
+    try:
+        _render_batch(batch_id, items, client, futures, shared_paths)
+    except Exception as exc:
+        _update_job(batch_id, {"status": "error", "stage": "done", "error": str(exc)})
+        return
+    finally:
+        # Renders still using the shared geometry finish first
+        wait(futures)
+        for path in shared_paths:
+            shared_geometry.release(path)
+
+    with _jobs_lock:
+        statuses = [item["status"] for item in _jobs.get(batch_id, {}).get("items", [])]
+    if statuses and all(status == "error" for status in statuses):
+        _update_job(batch_id, {"status": "error", "stage": "done", "error": "Every poster in the batch failed."})
+    else:
+        _update_job(batch_id, {"status": "done", "stage": "done"})
+
+
+def generate_batch_api(items, client=None):
+    if not items:
+        return {"status": "error", "error": "Add at least one poster to the batch."}
+    if len(items) > MAX_BATCH_ITEMS:
+        return {"status": "error", "error": f"A batch can hold at most {MAX_BATCH_ITEMS} posters."}
+
+    themes = get_available_themes()
+    batch_items = []
+    for index, item in enumerate(items):
+        distance = item.get("distance")
+        if distance is None:
+            distance = 29000
+        elif not isinstance(distance, int) or isinstance(distance, bool):
+            return {"status": "error", "error": f"Item {index + 1}: Distance must be a whole number of meters."}
+        values = {
+            "city": item["city"].strip(),
+            "country": item["country"].strip(),
+            "theme": item.get("theme") or "feature_based",
+            "distance": distance,
+            "format": (item.get("format") or "png").lower(),
+        }
+        error = _validation_error(values, themes)
+        if error:
+            return {"status": "error", "error": f"Item {index + 1}: {error}"}
+        batch_items.append(values)
+
+    batch_id = uuid.uuid4().hex
+    _set_job(
+        batch_id,
+        {
+            "status": "queued",
+            "kind": "batch",
+            "stage": "queued",
+            "total": len(batch_items),
+            "completed": 0,
+            "failed": 0,
+            "items": [{**values, "status": "queued"} for values in batch_items],
+        },
+    )
+    threading.Thread(target=_run_batch, args=(batch_id, batch_items, client), daemon=True).start()
+    return {"status": "queued", "job_id": batch_id, "total": len(batch_items)}
+
+
+@app.post("/api/generate/batch")
+def generate_batch(request: Request, batch: BatchRequest):
+    return generate_batch_api([item.model_dump() for item in batch.items], client=_client_id(request))
+
+
 @app.get("/api/geocode")
-def geocode_api(query: str = "", country: str = ""):
+async def geocode_api(query: str = "", country: str = "", session: str = ""):
     query = query.strip()
     country = country.strip()
 
     if not query:
         return {"status": "error", "error": "Enter a city or address to search."}
 
+    # The first call loads the gazetteer and the cache from disk, so keep
+    # them off the event loop
+    place = await run_in_threadpool(gazetteer.lookup, query, country)
+    if place:
+        return {"status": "ok", "lat": place["lat"], "lon": place["lon"]}
+    cached = await run_in_threadpool(geocode_cache.lookup, query, country) if country else None
+    if cached:
+        return {"status": "ok", "lat": cached["lat"], "lon": cached["lon"]}
+
     query_parts = [part for part in [query, country] if part]
     query = ", ".join(query_parts)
 
+    # Runs on the event loop: a burst of lookups waits on the rate limit
+    # without tying up the threadpool the sync routes run on.
+    try:
+        location = await geocoder.geocode(query, session=session or None)
+    except geocoder.Superseded:
+        return {"status": "superseded"}
+    except ValueError as exc:
+        return {"status": "error", "error": str(exc)}
+    except httpx.HTTPError as exc:
+        return {"status": "error", "error": f"Geocoding service unavailable: {exc}"}
+
+    return {"status": "ok", "lat": location["lat"], "lon": location["lon"]}
+
+
+@app.get("/api/places")
+async def places_api(prefix: str = "", country: str = "", limit: int = 8):
+    # Answered from memory, so it is cheap enough to call on every keystroke;
+    # only the first call after a (re)build reads the file
+    places = await run_in_threadpool(gazetteer.suggest, prefix, country, limit=max(1, min(limit, 20)))
+    return {"status": "ok", "available": gazetteer.available(), "places": places}
+
+
+def _area_geometry(coords, distance, client):
+    key = (round(coords[0], 5), round(coords[1], 5), distance)
+    with _geometry_lock:
+        payload = _geometry_cache.get(key)
+        if payload is not None:
+            _geometry_cache.move_to_end(key)
+            return payload
+
+    estimate = estimate_job(coords, distance)
+    fetch_bytes = admission.admissible_bytes(estimate, "fetch_bytes")
+    with admission.reserve(fetch_bytes, priority=_job_priority("", estimate), client=client):
+        map_data = fetch_map_data(coords, distance, show_progress=False)
+        record_map_data(coords, distance, map_data)
+        payload = geometry_payload.encode(pack_map_data(map_data), coords, OUTPUT_FIGSIZE)
+
+    with _geometry_lock:
+        _geometry_cache[key] = payload
+        while len(_geometry_cache) > GEOMETRY_CACHE_ITEMS:
+            _geometry_cache.popitem(last=False)
+    return payload
+
+
+@app.get("/api/geometry")
+def geometry_api(
+    request: Request,
+    city: str = "",
+    country: str = "",
+    lat: float | None = None,
+    lon: float | None = None,
+    distance: int = 29000,
+):
+    if distance <= 0:
+        return {"status": "error", "error": "Distance must be positive."}
+    if (lat is None or lon is None) and not (city.strip() and country.strip()):
+        return {"status": "error", "error": "City and country are required."}
+
     try:
-        ssl_context = ssl.create_default_context(cafile=certifi.where())
-        geolocator = Nominatim(user_agent="city_map_poster_webui", ssl_context=ssl_context)
-        time.sleep(1)
-        location = geolocator.geocode(query)
-        if not location:
-            raise ValueError("Location not found.")
+        coords = (lat, lon) if lat is not None and lon is not None else get_coordinates(city.strip(), country.strip())
+        payload = _area_geometry(coords, distance, _client_id(request))
     except Exception as exc:
         return {"status": "error", "error": str(exc)}
+    # Already gzip-compressed; the browser inflates it transparently
+    return Response(
+        payload,
+        media_type="application/octet-stream",
+        headers={"Content-Encoding": "gzip", "Cache-Control": "private, max-age=3600"},
+    )
+
 
-    return {"status": "ok", "lat": location.latitude, "lon": location.longitude}
+@app.get("/api/themes")
+def themes_api():
+    themes = {}
+    for name in get_available_themes():
+        theme = load_theme(name)
+        themes[name] = {
+            "name": theme.get("name", name),
+            "description": theme.get("description", ""),
+            **css_colors(theme),
+        }
+    return {"status": "ok", "road_classes": ROAD_CLASS_ORDER, "road_widths": ROAD_WIDTHS, "themes": themes}
 
 
 def delete_poster_api(filename: str):
     safe_name = os.path.basename(filename)
-    if not safe_name.lower().endswith(".png"):
+    if not safe_name.lower().endswith(POSTER_EXTENSIONS):
         return {"status": "error", "error": "Invalid filename."}
 
     source_path = os.path.join(POSTERS_DIR, safe_name)
@@ -303,7 +915,10 @@ def delete_poster_api(filename: str):
     if os.path.exists(trash_path):
         stem, ext = os.path.splitext(safe_name)
         trash_path = os.path.join(TRASH_DIR, f"{stem}_{int(time.time())}{ext}")
-    shutil.move(source_path, trash_path)
+    with _poster_move_lock:
+        shutil.move(source_path, trash_path)
+    storage.record(POSTERS_DIR, safe_name)
+    storage.touch(TRASH_DIR, os.path.basename(trash_path))
     return {"status": "ok", "filename": os.path.basename(trash_path)}
 
 
@@ -314,7 +929,7 @@ def delete_poster(filename: str = Form(...)):
 
 def restore_poster_api(filename: str):
     safe_name = os.path.basename(filename)
-    if not safe_name.lower().endswith(".png"):
+    if not safe_name.lower().endswith(POSTER_EXTENSIONS):
         return {"status": "error", "error": "Invalid filename."}
 
     source_path = os.path.join(TRASH_DIR, safe_name)
@@ -325,7 +940,10 @@ def restore_poster_api(filename: str):
     if os.path.exists(target_path):
         stem, ext = os.path.splitext(safe_name)
         target_path = os.path.join(POSTERS_DIR, f"{stem}_{int(time.time())}{ext}")
-    shutil.move(source_path, target_path)
+    with _poster_move_lock:
+        shutil.move(source_path, target_path)
+    storage.record(TRASH_DIR, safe_name)
+    storage.touch(POSTERS_DIR, os.path.basename(target_path))
     return {"status": "ok", "filename": os.path.basename(target_path)}
 
 
@@ -336,14 +954,14 @@ def restore_poster(filename: str = Form(...)):
 
 def purge_poster_api(filename: str):
     safe_name = os.path.basename(filename)
-    if not safe_name.lower().endswith(".png"):
+    if not safe_name.lower().endswith(POSTER_EXTENSIONS):
         return {"status": "error", "error": "Invalid filename."}
 
     source_path = os.path.join(TRASH_DIR, safe_name)
     if not os.path.exists(source_path):
         return {"status": "error", "error": "Poster not found."}
 
-    os.remove(source_path)
+    storage.purge(TRASH_DIR, [safe_name])
     return {"status": "ok", "filename": safe_name}
 
 
@@ -352,6 +970,38 @@ def purge_poster(filename: str = Form(...)):
     return purge_poster_api(filename)
 
 
+def purge_posters_api(filenames: list[str]):
+    safe_names = [os.path.basename(filename) for filename in filenames]
+    if not safe_names or not all(name.lower().endswith(POSTER_EXTENSIONS) for name in safe_names):
+        return {"status": "error", "error": "Invalid filename."}
+
+    removed, freed = storage.purge(TRASH_DIR, safe_names)
+    return {"status": "ok", "removed": removed, "freed_bytes": freed}
+
+
+@app.post("/api/posters/purge-bulk")
+def purge_posters(filenames: list[str] = Form(...)):
+    return purge_posters_api(filenames)
+
+
+def empty_trash_api(older_than_days: float = 0):
+    if older_than_days < 0:
+        return {"status": "error", "error": "Age must not be negative."}
+
+    removed, freed = storage.purge(TRASH_DIR, older_than_days=older_than_days)
+    return {"status": "ok", "removed": removed, "freed_bytes": freed}
+
+
+@app.post("/api/trash/empty")
+def empty_trash(older_than_days: float = Form(0)):
+    return empty_trash_api(older_than_days)
+
+
+@app.get("/api/storage")
+def storage_api():
+    return {"status": "ok", **storage.usage()}
+
+
 @strawberry.type
 class Meta:
     Title: str | None = None
@@ -372,6 +1022,25 @@ class FileItem:
     meta: Meta | None = None
 
 
+@strawberry.type
+class ProfileFiles:
+    pstats: str
+    collapsed: str
+    allocations: str
+    seconds: float
+    peak_traced_mb: float
+
+
+@strawberry.type
+class OutputFile:
+    filename: str
+    path: str
+    format: str
+    width: float
+    height: float
+    dpi: int
+
+
 @strawberry.type
 class JobStatus:
     status: str
@@ -379,6 +1048,75 @@ class JobStatus:
     filename: str | None = None
     path: str | None = None
     error: str | None = None
+    estimated_memory_mb: float | None = None
+    priority: str | None = None
+    profile: ProfileFiles | None = None
+    outputs: list[OutputFile] | None = None
+
+
+@strawberry.input
+class BatchItemInput:
+    city: str
+    country: str
+    theme: str = "feature_based"
+    distance: int = 29000
+    format: str = "png"
+
+
+@strawberry.type
+class BatchItemStatus:
+    city: str
+    country: str
+    theme: str
+    distance: int
+    format: str
+    status: str
+    filename: str | None = None
+    path: str | None = None
+    error: str | None = None
+
+
+@strawberry.type
+class BatchStatus:
+    status: str
+    job_id: str | None = None
+    stage: str | None = None
+    total: int = 0
+    completed: int = 0
+    failed: int = 0
+    items: list[BatchItemStatus] | None = None
+    error: str | None = None
+
+
+@strawberry.type
+class FolderUsage:
+    files: int
+    bytes: float
+    max_bytes: float
+    max_age_days: float
+
+
+@strawberry.type
+class DiskUsage:
+    total_bytes: float
+    used_bytes: float
+    free_bytes: float
+    min_free_bytes: float
+
+
+@strawberry.type
+class StorageUsage:
+    posters: FolderUsage
+    trash: FolderUsage
+    disk: DiskUsage
+
+
+@strawberry.type
+class PurgeResult:
+    status: str
+    removed: list[str] | None = None
+    freed_bytes: float | None = None
+    error: str | None = None
 
 
 @strawberry.type
@@ -395,6 +1133,31 @@ def _meta_from_dict(data):
     return Meta(**data)
 
 
+def _batch_status(job_id, job):
+    return BatchStatus(
+        status=job.get("status"),
+        job_id=job_id,
+        stage=job.get("stage"),
+        total=job.get("total", 0),
+        completed=job.get("completed", 0),
+        failed=job.get("failed", 0),
+        items=[
+            BatchItemStatus(
+                city=item["city"],
+                country=item["country"],
+                theme=item["theme"],
+                distance=item["distance"],
+                format=item["format"],
+                status=item["status"],
+                filename=item.get("filename"),
+                path=item.get("path"),
+                error=item.get("error"),
+            )
+            for item in job.get("items", [])
+        ],
+    )
+
+
 @strawberry.type
 class Query:
     @strawberry.field
@@ -451,25 +1214,75 @@ class Query:
             filename=job.get("filename"),
             path=job.get("path"),
             error=job.get("error"),
+            estimated_memory_mb=job.get("estimated_memory_mb"),
+            priority=job.get("priority"),
+            profile=ProfileFiles(**job["profile"]) if job.get("profile") else None,
+            outputs=[OutputFile(**output) for output in job["outputs"]] if job.get("outputs") else None,
+        )
+
+    @strawberry.field
+    def storage(self) -> StorageUsage:
+        usage = storage.usage()
+        return StorageUsage(
+            posters=FolderUsage(**usage["posters"]),
+            trash=FolderUsage(**usage["trash"]),
+            disk=DiskUsage(**usage["disk"]),
         )
 
+    @strawberry.field
+    def batch(self, job_id: str) -> BatchStatus:
+        job = _get_job(job_id)
+        if not job or job.get("kind") != "batch":
+            return BatchStatus(status="error", error="Batch not found.")
+        return _batch_status(job_id, job)
+
 
 @strawberry.type
 class Mutation:
     @strawberry.mutation
-    def geocode(self, query: str, country: str = "") -> GeocodeResult:
-        result = geocode_api(query=query, country=country)
+    async def geocode(self, query: str, country: str = "", session: str = "") -> GeocodeResult:
+        result = await geocode_api(query=query, country=country, session=session)
         return GeocodeResult(**result)
 
     @strawberry.mutation
-    def generate(self, city: str, country: str, theme: str = "feature_based", distance: int = 29000) -> JobStatus:
-        result = generate_api(city=city, country=country, theme=theme, distance=distance)
+    def generate(
+        self,
+        info: strawberry.Info,
+        city: str,
+        country: str,
+        theme: str = "feature_based",
+        distance: int = 29000,
+        output_format: str = "png",
+        priority: str = "",
+        profile: bool = False,
+        sizes: list[str] | None = None,
+    ) -> JobStatus:
+        result = generate_api(
+            request=info.context["request"],
+            city=city,
+            country=country,
+            theme=theme,
+            distance=distance,
+            output_format=output_format,
+            priority=priority,
+            profile=profile,
+            sizes=" ".join(sizes or []),
+        )
         return JobStatus(
             status=result.get("status"),
             job_id=result.get("job_id"),
             error=result.get("error"),
         )
 
+    @strawberry.mutation
+    def generate_batch(self, info: strawberry.Info, items: list[BatchItemInput]) -> BatchStatus:
+        result = generate_batch_api(
+            [strawberry.asdict(item) for item in items], client=_client_id(info.context["request"])
+        )
+        if result.get("status") == "error":
+            return BatchStatus(status="error", error=result.get("error"))
+        return _batch_status(result["job_id"], _get_job(result["job_id"]))
+
     @strawberry.mutation
     def delete_poster(self, filename: str) -> JobStatus:
         result = delete_poster_api(filename)
@@ -485,6 +1298,14 @@ class Mutation:
         result = purge_poster_api(filename)
         return JobStatus(status=result.get("status"), filename=result.get("filename"), error=result.get("error"))
 
+    @strawberry.mutation
+    def purge_posters(self, filenames: list[str]) -> PurgeResult:
+        return PurgeResult(**purge_posters_api(filenames))
+
+    @strawberry.mutation
+    def empty_trash(self, older_than_days: float = 0) -> PurgeResult:
+        return PurgeResult(**empty_trash_api(older_than_days))
+
 
 schema = strawberry.Schema(query=Query, mutation=Mutation)
 app.include_router(GraphQLRouter(schema), prefix="/graphql")